@@ -8,9 +8,7 @@ from django.conf import settings
 from django.contrib import admin
 from django.contrib.admin import helpers
 from django.contrib.contenttypes.generic import GenericInlineModelAdmin, GenericRelation
-from django.contrib.contenttypes.models import ContentType
 from django.core.urlresolvers import reverse
-from django.core.paginator import Paginator, EmptyPage
 from django.forms.formsets import all_valid
 from django.forms.models import model_to_dict
 from django.http import HttpResponseRedirect, Http404
@@ -20,8 +18,10 @@ from django.utils.html import mark_safe
 from django.utils.text import capfirst
 from django.utils.translation import ugettext as _
 from django.utils.encoding import force_unicode
+from django.utils.http import urlencode
 
 import reversion
+from reversion.caches import content_type_cache
 from reversion.models import Version
 from reversion.revisions import DEFAULT_SERIALIZATION_FORMAT, revision
 
@@ -95,19 +95,17 @@ class VersionAdmin(admin.ModelAdmin):
         return reversion_urls + urls
 
     def diff_list(self, request, lhs_version, rhs_version):
-        versions = Version.objects.filter(pk__in=(int(lhs_version), int(rhs_version)))
+        versions = list(Version.objects.filter(pk__in=(int(lhs_version), int(rhs_version))))
         if len(versions) != 2:
             raise Http404()
         info = revision.get_registration_info(self.model)
-        field_diff = [] 
         lhs, rhs = versions
-        from reversion.helpers import generate_patch_html
+        from reversion.helpers import generate_patches_html
         opts = self.model._meta
-        for field_name in info.fields:
-            field_diff.append({
-                'field':opts.get_field_by_name(field_name)[0],
-                'patch':generate_patch_html(lhs, rhs, field_name),
-            }) 
+        patches = generate_patches_html(lhs, rhs, info.fields)
+        field_diff = [{'field': opts.get_field_by_name(field_name)[0],
+                       'patch': patches[field_name]}
+                      for field_name in info.fields]
 
         context = {
             'opts': opts,
@@ -132,15 +130,34 @@ class VersionAdmin(admin.ModelAdmin):
         revision.comment = message
     
     def recoverlist_view(self, request, extra_context=None):
-        """Displays a deleted model to allow recovery."""
+        """
+        Displays a deleted model to allow recovery.
+        
+        The deleted versions are paged with a keyset, and can be searched by
+        their representation.
+        """
         model = self.model
         opts = model._meta
-        deleted = Version.objects.get_deleted(self.model, select_related=("revision",))
+        after = request.GET.get("after")
+        if after is not None:
+            try:
+                after = int(after)
+            except ValueError:
+                raise Http404()
+        search = request.GET.get("q", "")
+        deleted, has_more = Version.objects.get_deleted_page(self.model, after, search)
+        next_url = None
+        if has_more:
+            next_url = "?%s" % urlencode({"after": deleted[-1].pk, "q": search})
         context = {"opts": opts,
                    "app_label": opts.app_label,
                    "module_name": capfirst(opts.verbose_name),
                    "title": _("Recover deleted %(name)s") % {"name": force_unicode(opts.verbose_name_plural)},
                    "deleted": deleted,
+                   "search": search,
+                   "is_paged": after is not None,
+                   "first_url": "?%s" % urlencode({"q": search}),
+                   "next_url": next_url,
                    "changelist_url": reverse("admin:%s_%s_changelist" % (opts.app_label, opts.module_name)),}
         extra_context = extra_context or {}
         context.update(extra_context)
@@ -219,32 +236,31 @@ class VersionAdmin(admin.ModelAdmin):
             # of queries required to construct the formets.
             form = ModelForm(instance=obj, initial=self.get_revision_form_data(request, obj, version))
             prefixes = {}
-            revision_versions = version.revision.version_set.all()
-            for FormSet, inline in zip(self.get_formsets(request, obj), self.inline_instances):
+            # Load the versions of the revision once, grouped by model, and
+            # deserialize them together.
+            revision_versions = {}
+            for revision_version in version.revision.version_set.all():
+                revision_versions.setdefault(content_type_cache.get_model(revision_version.get_content_type_value()), []).append(revision_version)
+            FormSets = list(self.get_formsets(request, obj))
+            inline_models = set([FormSet.model for FormSet in FormSets])
+            Version.objects.prefetch_field_dicts([revision_version for inline_model in inline_models
+                                                  for revision_version in revision_versions.get(inline_model, ())])
+            for FormSet, inline in zip(FormSets, self.inline_instances):
                 # Now we hack it to push in the data from the revision!
-
-                get_object_filter = lambda x: x
                 try:
                     fk_name = FormSet.fk.name
                 except AttributeError:
                     # This is a GenericInlineFormset, or similar.
                     fk_name = FormSet.ct_fk_field.name
-                    get_object_filter = lambda x: x.pk
                 related_versions = dict([(related_version.object_id, related_version)
-                                         for related_version in revision_versions
-                                         if related_version.content_type.model_class() == FormSet.model
-                                         and unicode(related_version.field_dict[fk_name]) == unicode(object_id)])
-
-
-                pks = set([unicode(o.pk) for o in inline.model._default_manager.complex_filter({fk_name:get_object_filter(obj)}).all()])
-                other_pks = set([unicode(i) for i in related_versions])
-
+                                         for related_version in revision_versions.get(FormSet.model, ())
+                                         if unicode(related_version.field_dict[fk_name]) == unicode(object_id)])
                 # This code is standard for creating the formset.
                 prefix = FormSet.get_default_prefix()
                 prefixes[prefix] = prefixes.get(prefix, 0) + 1
                 if prefixes[prefix] != 1:
                     prefix = "%s-%s" % (prefix, prefixes[prefix])
-                formset = type('NoExtra', (FormSet,), {'extra':len(other_pks.difference(pks))})(instance=obj, prefix=prefix,
+                formset = type('NoExtra', (FormSet,), {'extra':0})(instance=obj, prefix=prefix,
                                   queryset=inline.queryset(request))
                 initial = []
                 for related_obj in formset.queryset:
@@ -254,8 +270,10 @@ class VersionAdmin(admin.ModelAdmin):
                         initial_data = model_to_dict(related_obj)
                         initial_data["DELETE"] = True
                         initial.append(initial_data)
+                # Objects that no longer exist are added as extra forms.
+                formset.extra = len(related_versions)
                 for related_version in related_versions.values():
-                    initial_row = related_version.field_dict
+                    initial_row = related_version.field_dict.copy()
                     del initial_row["id"]
                     initial.append(initial_row)
                 # Reconstruct the forms with the new revision data.
@@ -296,7 +314,7 @@ class VersionAdmin(admin.ModelAdmin):
                         "ordered_objects": opts.get_ordered_objects(),
                         "form_url": mark_safe(request.path),
                         "opts": opts,
-                        "content_type_id": ContentType.objects.get_for_model(self.model).id,
+                        "content_type_id": content_type_cache.get_for_model(self.model).id,
                         "save_as": False,
                         "save_on_top": self.save_on_top,
                         "changelist_url": reverse("admin:%s_%s_changelist" % (opts.app_label, opts.module_name)),
@@ -356,9 +374,26 @@ class VersionAdmin(admin.ModelAdmin):
         return super(VersionAdmin, self).changelist_view(request, context)
     
     def history_view(self, request, object_id, extra_context=None):
-        """Renders the history view.""" 
-        available_versions = Version.objects.get_for_object_reference(self.model, object_id).order_by('-revision__date_created')
-        if len(available_versions) == 0 or request.GET.get('use_reversion', 'true').lower() != 'true':
+        """
+        Renders the history view.
+        
+        The history is paged with a keyset, so that every page costs the same
+        number of queries, however long the history of the object is.
+        """
+        after = request.GET.get('after')
+        if after is not None:
+            try:
+                after = int(after)
+            except ValueError:
+                raise Http404()
+        use_reversion = request.GET.get('use_reversion', 'true').lower() == 'true'
+        versions, has_more = [], False
+        if use_reversion:
+            try:
+                versions, has_more = Version.objects.get_page_for_object_reference(self.model, object_id, after)
+            except Version.DoesNotExist:
+                raise Http404()
+        if not use_reversion or (not versions and after is None):
             # either no versions are available inside of reversion or the user is requesting pre-reversion
             # data. Fall back to the default history view displaying admin log entries.
             extra_context = extra_context or dict()
@@ -366,30 +401,16 @@ class VersionAdmin(admin.ModelAdmin):
             return super(VersionAdmin, self).history_view(request, object_id, extra_context)
 
         opts = self.model._meta
-        try:
-            paginator = Paginator(Version.objects.get_for_object_reference(self.model, object_id).order_by('-revision__date_created'), 20)
-            page_no = int(request.GET.get('p', 0))
-            page = paginator.page(page_no+1)
-        except EmptyPage:
-            raise Http404()
-
-        attrs = {
-            'paginator':paginator,
-            'page_num':page_no,
-            'show_all':False,
-            'can_show_all':False,
-            'multi_page':True,
-            'get_query_string': lambda self, query : '?p=%(p)d' % query 
-        }
-
-        cl = type('HistoryChangeList', (object,), attrs)()
-
-        action_list = ({"revision": version.revision,
+        action_list = [{"revision": version.revision,
                         "url": reverse("admin:%s_%s_revision" % (opts.app_label, opts.module_name), args=(version.object_id, version.id))}
-                       for version in page.object_list)
+                       for version in versions]
+        next_url = None
+        if has_more:
+            next_url = "?after=%d" % versions[-1].pk
         # Compile the context.
-        context = {"action_list": action_list, "cl":cl, "use_template": 'reversion/object_history_reversion.html'}
+        context = {"action_list": action_list,
+                   "is_paged": after is not None,
+                   "next_url": next_url,
+                   "use_template": 'reversion/object_history_reversion.html'}
         context.update(extra_context or {})
         return super(VersionAdmin, self).history_view(request, object_id, context)
-    
-    
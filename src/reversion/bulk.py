@@ -0,0 +1,74 @@
+"""Bulk database operations used by Reversion."""
+
+
+from django.db import connections, router, transaction
+from django.db.models import AutoField
+
+
+# The maximum number of parameters that can be bound to a single query.  This
+# is the lowest common denominator of the supported backends (SQLite).
+MAX_QUERY_PARAMS = 999
+
+
+def chunked(items, size):
+    """Splits the given sequence into lists of at most `size` items."""
+    items = list(items)
+    for start in xrange(0, len(items), size):
+        yield items[start:start+size]
+
+
+def bulk_insert(model, objs, using=None, raw=False):
+    """
+    Inserts the given model instances using one multi-row INSERT statement per
+    chunk of instances.
+
+    Only the local fields of the model are written, which matches the
+    behaviour of a raw save.  Auto-incrementing primary keys are written only
+    if they are set on the instances, and generated keys are not fetched back.
+    No signals are sent.
+    """
+    objs = list(objs)
+    if not objs:
+        return
+    using = using or router.db_for_write(model)
+    fields = model._meta.local_fields
+    auto_fields = [field for field in fields if isinstance(field, AutoField)]
+    if auto_fields:
+        # Instances with and without a primary key are inserted separately, as
+        # their rows have different columns.
+        auto_field = auto_fields[0]
+        objs_with_pk = [obj for obj in objs if getattr(obj, auto_field.attname) is not None]
+        objs_without_pk = [obj for obj in objs if getattr(obj, auto_field.attname) is None]
+        _insert_rows(model, objs_with_pk, fields, using, raw)
+        _insert_rows(model, objs_without_pk, [field for field in fields if field is not auto_field], using, raw)
+    else:
+        _insert_rows(model, objs, fields, using, raw)
+    transaction.commit_unless_managed(using=using)
+
+
+def _insert_rows(model, objs, fields, using, raw):
+    """Inserts the given fields of the given model instances."""
+    if not objs:
+        return
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    sql = u"INSERT INTO %s (%s) VALUES " % (qn(model._meta.db_table), u", ".join([qn(field.column) for field in fields]))
+    row_sql = u"(%s)" % u", ".join([u"%s"] * len(fields))
+    # Oracle does not support multi-row VALUES clauses.
+    multi_row = not "oracle" in connection.settings_dict["ENGINE"]
+    cursor = connection.cursor()
+    for chunk in chunked(objs, max(1, MAX_QUERY_PARAMS // len(fields))):
+        rows = []
+        for obj in chunk:
+            row = []
+            for field in fields:
+                if raw:
+                    value = getattr(obj, field.attname)
+                else:
+                    value = field.pre_save(obj, True)
+                row.append(field.get_db_prep_save(value, connection=connection))
+            rows.append(row)
+        if multi_row:
+            cursor.execute(sql + u", ".join([row_sql] * len(rows)), [param for row in rows for param in row])
+        else:
+            cursor.executemany(sql + row_sql, rows)
@@ -0,0 +1,202 @@
+"""Caches used by Reversion."""
+
+
+from threading import Lock
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db.models.signals import post_save, post_delete, post_syncdb
+from django.utils import simplejson
+
+
+class LRUCache(object):
+
+    """
+    A thread-safe cache that discards the least recently used items once it
+    holds more than `size` items.
+
+    The number of hits, misses and evictions are counted, so that the size of
+    the cache can be tuned.  A cache with a size of zero stores nothing.
+    """
+
+    def __init__(self, size):
+        """Initializes the LRUCache."""
+        self.size = size
+        self._lock = Lock()
+        self.clear()
+
+    def _move_to_front(self, link):
+        """Marks the given link as the most recently used."""
+        previous_link, next_link = link[0], link[1]
+        previous_link[1] = next_link
+        next_link[0] = previous_link
+        root = self._root
+        first_link = root[1]
+        link[0] = root
+        link[1] = first_link
+        first_link[0] = link
+        root[1] = link
+
+    def get(self, key, default=None):
+        """Returns the value cached for the given key, or the given default."""
+        self._lock.acquire()
+        try:
+            link = self._links.get(key)
+            if link is None:
+                self.misses += 1
+                return default
+            self._move_to_front(link)
+            self.hits += 1
+            return link[3]
+        finally:
+            self._lock.release()
+
+    def set(self, key, value):
+        """Caches the given value, evicting the least recently used if full."""
+        if self.size <= 0:
+            return
+        self._lock.acquire()
+        try:
+            link = self._links.get(key)
+            if link is not None:
+                link[3] = value
+                self._move_to_front(link)
+                return
+            # Links are lists of [previous, next, key, value].
+            root = self._root
+            first_link = root[1]
+            link = [root, first_link, key, value]
+            first_link[0] = link
+            root[1] = link
+            self._links[key] = link
+            if len(self._links) > self.size:
+                last_link = root[0]
+                last_link[0][1] = root
+                root[0] = last_link[0]
+                del self._links[last_link[2]]
+                self.evictions += 1
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """Removes all items from the cache and resets the counters."""
+        self._lock.acquire()
+        try:
+            root = []
+            root[:] = [root, root, None, None]
+            self._root = root
+            self._links = {}
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        """Returns the number of cached items."""
+        return len(self._links)
+
+
+# A process-wide cache of deserialized versions, disabled unless a size is set.
+object_version_cache = LRUCache(getattr(settings, "REVERSION_OBJECT_CACHE_SIZE", 0))
+
+
+class ContentTypeCache(object):
+
+    """
+    A thread-safe map between models, their content types, and the values that
+    versions store for those content types.
+
+    The values are content type ids, or natural keys when
+    `REVERSION_USE_MULTI_DB` is set.  Each content type is looked up once per
+    process, until content types are saved, deleted or flushed.
+    """
+
+    def __init__(self):
+        """Initializes the ContentTypeCache."""
+        self._lock = Lock()
+        self.clear()
+
+    def _get_value(self, content_type):
+        """Returns the value stored by versions for the given content type."""
+        if getattr(settings, "REVERSION_USE_MULTI_DB", False):
+            return simplejson.dumps(content_type.natural_key())
+        return content_type.pk
+
+    def _add(self, content_type, model_class=None):
+        """Adds the given content type, returning its value."""
+        value = self._get_value(content_type)
+        self._lock.acquire()
+        try:
+            if model_class is not None:
+                self._values[model_class] = value
+            self._content_types[value] = content_type
+        finally:
+            self._lock.release()
+        return value
+
+    def get_value(self, model_class):
+        """Returns the value stored by versions of the given model."""
+        try:
+            return self._values[model_class]
+        except KeyError:
+            return self._add(ContentType.objects.get_for_model(model_class), model_class)
+
+    def get_content_type(self, value):
+        """Returns the content type for the given stored value."""
+        try:
+            return self._content_types[value]
+        except KeyError:
+            if getattr(settings, "REVERSION_USE_MULTI_DB", False):
+                content_type = ContentType.objects.get_by_natural_key(*simplejson.loads(value))
+            else:
+                content_type = ContentType.objects.get_for_id(value)
+            self._add(content_type)
+            return content_type
+
+    def get_for_model(self, model_class):
+        """Returns the content type of the given model."""
+        return self.get_content_type(self.get_value(model_class))
+
+    def get_model(self, value):
+        """Returns the model class for the given stored value."""
+        try:
+            return self._models[value]
+        except KeyError:
+            model_class = self.get_content_type(value).model_class()
+            self._lock.acquire()
+            try:
+                self._models[value] = model_class
+            finally:
+                self._lock.release()
+            return model_class
+
+    def clear(self):
+        """Removes all content types from the cache."""
+        self._lock.acquire()
+        try:
+            self._values = {}
+            self._content_types = {}
+            self._models = {}
+        finally:
+            self._lock.release()
+
+
+# A process-wide cache of the content types of versioned models.
+content_type_cache = ContentTypeCache()
+
+
+def clear_content_type_caches(sender, **kwargs):
+    """
+    Clears the content type cache, and Django's own content type cache unless
+    a content type was only saved, so that stale content types are not used.
+    """
+    content_type_cache.clear()
+    if sender is not ContentType or not "created" in kwargs:
+        ContentType.objects.clear_cache()
+
+
+post_save.connect(clear_content_type_caches, sender=ContentType)
+post_delete.connect(clear_content_type_caches, sender=ContentType)
+# Sent once a database has been created or flushed.
+post_syncdb.connect(clear_content_type_caches)
@@ -0,0 +1,43 @@
+"""
+Field-level deltas between json serializations of a model.
+
+A delta is a json document of the same shape as a full serialization, but
+containing only the fields that changed since the previous version.  Full
+serializations are rebuilt by replaying deltas over the nearest keyframe.
+"""
+
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import simplejson
+
+
+# Serialization formats that can be stored as deltas.
+DELTA_FORMATS = ("json", "fastjson")
+
+
+def make_delta(previous_data, serialized_data):
+    """
+    Returns the delta that turns the previous serialization into the given
+    serialization.
+    """
+    previous_fields = simplejson.loads(previous_data)[0]["fields"]
+    current = simplejson.loads(serialized_data)[0]
+    changed_fields = {}
+    for name, value in current["fields"].iteritems():
+        if not name in previous_fields or previous_fields[name] != value:
+            changed_fields[name] = value
+    return simplejson.dumps([{"model": current["model"],
+                              "pk": current["pk"],
+                              "fields": changed_fields}], cls=DjangoJSONEncoder)
+
+
+def replay(serialized_data, deltas):
+    """
+    Applies the given sequence of deltas to a full serialization.  Applying
+    deltas to a delta merges them into a single delta.
+    """
+    document = simplejson.loads(serialized_data)
+    for delta in deltas:
+        document[0]["fields"].update(simplejson.loads(delta)[0]["fields"])
+    return simplejson.dumps(document, cls=DjangoJSONEncoder)
+
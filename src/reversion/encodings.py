@@ -0,0 +1,122 @@
+"""
+Encodings used to store the serialized data of versions.
+
+The encoding of each version is recorded alongside its serialization format,
+so rows written with different encodings can be read back side by side.
+Compressed encodings store base64 text, so they are opt-in, with
+`REVERSION_ENCODING`.
+"""
+
+
+import base64
+import zlib
+
+from django.conf import settings
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class EncodingError(Exception):
+
+    """Exception thrown when serialized data cannot be encoded or decoded."""
+
+
+class Encoding(object):
+
+    """A named pair of functions that encode and decode serialized data."""
+
+    __slots__ = "name", "encode_bytes", "decode_bytes",
+
+    def __init__(self, name, encode_bytes, decode_bytes):
+        """Initializes the encoding."""
+        self.name = name
+        self.encode_bytes = encode_bytes
+        self.decode_bytes = decode_bytes
+
+    def encode(self, data):
+        """Encodes the given serialized data into text that can be stored."""
+        if isinstance(data, unicode):
+            data = data.encode("utf8")
+        return base64.b64encode(self.encode_bytes(data))
+
+    def decode(self, data):
+        """Decodes the given stored text back into serialized data."""
+        if isinstance(data, unicode):
+            data = data.encode("ascii")
+        return self.decode_bytes(base64.b64decode(data)).decode("utf8")
+
+
+class PlainEncoding(Encoding):
+
+    """The encoding of uncompressed data, used by versions saved before encodings."""
+
+    def __init__(self):
+        """Initializes the plain encoding."""
+        super(PlainEncoding, self).__init__("", None, None)
+
+    def encode(self, data):
+        """Returns the data unchanged."""
+        return data
+
+    def decode(self, data):
+        """Returns the data unchanged."""
+        return data
+
+
+_encodings = {}
+
+
+def register_encoding(encoding):
+    """Makes the given encoding available for storing serialized data."""
+    _encodings[encoding.name] = encoding
+
+
+def get_encoding(name):
+    """Returns the encoding with the given name."""
+    try:
+        return _encodings[name]
+    except KeyError:
+        raise EncodingError, "The serialized data encoding %r is not available." % name
+
+
+def encode(data, name):
+    """Encodes the given serialized data with the named encoding."""
+    return get_encoding(name).encode(data)
+
+
+def decode(data, name):
+    """Decodes the given stored data with the named encoding."""
+    return get_encoding(name).decode(data)
+
+
+register_encoding(PlainEncoding())
+
+register_encoding(Encoding("zlib", zlib.compress, zlib.decompress))
+
+if zstandard is not None:
+    register_encoding(Encoding("zstd",
+                               lambda data: zstandard.ZstdCompressor().compress(data),
+                               lambda data: zstandard.ZstdDecompressor().decompress(data)))
+
+
+# The encoding used for newly saved versions.  Compression is opt-in, so by
+# default serialized data is stored as plain text.
+DEFAULT_ENCODING = getattr(settings, "REVERSION_ENCODING", "")
+
+# Serialized data shorter than this many characters is stored as plain text,
+# as the base64 text of a compressed small document is not much smaller.
+ENCODING_THRESHOLD = getattr(settings, "REVERSION_ENCODING_THRESHOLD", 512)
+
+
+def get_storage_encoding(data):
+    """
+    Returns the name of the encoding to store the given serialized data with,
+    which is `DEFAULT_ENCODING` if the data is at least `ENCODING_THRESHOLD`
+    characters long.
+    """
+    if len(data) < ENCODING_THRESHOLD:
+        return ""
+    return DEFAULT_ENCODING
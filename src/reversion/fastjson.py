@@ -0,0 +1,46 @@
+"""
+A json serialization format that decodes with the fastest available codec.
+
+Documents are written exactly as the stock "json" format writes them, so rows
+saved in either format can be read by the other.  They are read with the
+`ujson` codec when it is installed, which is several times faster than the
+stock codec at decoding.  Encoding stays with the stock codec, as encoding
+exactly with `ujson` costs more than it saves.
+"""
+
+
+from django.core.serializers.json import Serializer as JSONSerializer
+from django.core.serializers.python import Deserializer as PythonDeserializer
+from django.utils import simplejson
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+if ujson is None:
+    loads = simplejson.loads
+else:
+    def loads(data):
+        """Decodes the given json data."""
+        try:
+            return ujson.loads(data, precise_float=True)
+        except ValueError:
+            # Integers too big for the fast codec.
+            return simplejson.loads(data)
+
+
+class Serializer(JSONSerializer):
+
+    """Serializes a queryset to json, exactly as the stock json format does."""
+
+
+def Deserializer(stream_or_string, **options):
+    """Deserializes a stream or string of json data using the fast codec."""
+    if isinstance(stream_or_string, basestring):
+        data = stream_or_string
+    else:
+        data = stream_or_string.read()
+    for obj in PythonDeserializer(loads(data), **options):
+        yield obj
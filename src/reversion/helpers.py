@@ -1,10 +1,19 @@
 """A number of useful helper functions to automate common tasks."""
 
 
+import hashlib, sys, time
+
+from django.conf import settings
 from django.contrib import admin
 from django.contrib.admin.sites import NotRegistered
+from django.core.cache import cache, get_cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import simplejson
+from django.utils.encoding import force_unicode, smart_str
 
 from reversion.admin import VersionAdmin
+from reversion.models import Version
+from reversion.serialization import get_content_hash
 
 
 def patch_admin(model, admin_site=None):
@@ -40,30 +49,210 @@ except ImportError:
     pass
 else:
     dmp = diff_match_patch()
-
-    def generate_diffs(old_version, new_version, field_name):
-        """Generates a diff array for the named field between the two versions."""
-        # Extract the text from the versions.
-        old_text = str(old_version.field_dict[field_name])
-        new_text = str(new_version.field_dict[field_name])
-
-        # Generate the patch.
-        diffs = dmp.diff_main(old_text, new_text)
+    
+    # Texts longer than this, in total, are diffed line by line.
+    DIFF_SIZE_LIMIT = getattr(settings, "REVERSION_DIFF_SIZE_LIMIT", 100000)
+    
+    # The number of seconds that a diff may take before it is cut short.
+    DIFF_TIMEOUT = getattr(settings, "REVERSION_DIFF_TIMEOUT", 1.0)
+    
+    # The cache that rendered differences are stored in.
+    if getattr(settings, "REVERSION_DIFF_CACHE_BACKEND", None):
+        diff_cache = get_cache(settings.REVERSION_DIFF_CACHE_BACKEND)
+    else:
+        diff_cache = cache
+    
+    DIFF_CACHE_TIMEOUT = getattr(settings, "REVERSION_DIFF_CACHE_TIMEOUT", None)
+    
+    # The granularities that differences can be generated at.
+    DIFF_CHARS = "chars"
+    DIFF_LINES = "lines"
+    DIFF_STRUCTURE = "structure"
+    
+    def get_deadline(timeout=None):
+        """Returns the time that a diff started now must finish by."""
+        if timeout is None:
+            timeout = DIFF_TIMEOUT
+        if timeout <= 0:
+            return sys.maxint
+        return time.time() + timeout
+    
+    def diff_chars(old_text, new_text, deadline):
+        """Generates a character level diff array between the two texts."""
+        return dmp.diff_main(old_text, new_text, False, deadline)
+    
+    def diff_lines(old_text, new_text, deadline):
+        """
+        Generates a diff array between the two texts, matching whole lines.
+        
+        Each run of changed lines is then refined to a character level diff, if
+        it is shorter than `DIFF_SIZE_LIMIT`.
+        """
+        old_chars, new_chars, lines = dmp.diff_linesToChars(old_text, new_text)
+        line_diffs = dmp.diff_main(old_chars, new_chars, False, deadline)
+        dmp.diff_charsToLines(line_diffs, lines)
+        diffs = []
+        deleted_text, inserted_text = [], []
+        # A sentinel equality flushes the last run of changes.
+        for operation, text in line_diffs + [(diff_match_patch.DIFF_EQUAL, u"")]:
+            if operation == diff_match_patch.DIFF_DELETE:
+                deleted_text.append(text)
+            elif operation == diff_match_patch.DIFF_INSERT:
+                inserted_text.append(text)
+            else:
+                deleted_text, inserted_text = u"".join(deleted_text), u"".join(inserted_text)
+                if deleted_text and inserted_text and len(deleted_text) + len(inserted_text) <= DIFF_SIZE_LIMIT:
+                    diffs.extend(diff_chars(deleted_text, inserted_text, deadline))
+                else:
+                    if deleted_text:
+                        diffs.append((diff_match_patch.DIFF_DELETE, deleted_text))
+                    if inserted_text:
+                        diffs.append((diff_match_patch.DIFF_INSERT, inserted_text))
+                if text:
+                    diffs.append((operation, text))
+                deleted_text, inserted_text = [], []
+        dmp.diff_cleanupMerge(diffs)
         return diffs
     
-    def generate_patch(old_version, new_version, field_name):
+    structure_encoder = DjangoJSONEncoder(ensure_ascii=False)
+    
+    def flatten_structure(value, path, lines):
+        """
+        Appends a line for each leaf of the given dict or list value, holding
+        its path and its value as json.  Lists of plain values are leaves.
+        """
+        if isinstance(value, dict) and value:
+            for key in sorted(value):
+                flatten_structure(value[key], u"%s.%s" % (path, key), lines)
+        elif isinstance(value, (list, tuple)) and [item for item in value if isinstance(item, (dict, list, tuple))]:
+            for index, item in enumerate(value):
+                flatten_structure(item, u"%s[%d]" % (path, index), lines)
+        else:
+            lines.append(u"%s: %s\n" % (path or u".", structure_encoder.encode(value)))
+    
+    def format_structure(value):
+        """
+        Returns the given dict or list value, or json text, as a line for each
+        of its leaves, so that a line diff matches up its unchanged parts.
+        """
+        if isinstance(value, basestring):
+            try:
+                value = simplejson.loads(value)
+            except ValueError:
+                return value
+        lines = []
+        flatten_structure(value, u"", lines)
+        return u"".join(lines)
+    
+    def diff_values(old_value, new_value, mode=None, timeout=None):
+        """
+        Generates a diff array between the two field values.
+        
+        The `mode` may be `DIFF_CHARS`, `DIFF_LINES`, or `DIFF_STRUCTURE`, which
+        diffs dict and list values, or json text, by key and item.  By default,
+        values longer than `DIFF_SIZE_LIMIT` are diffed by line, and other
+        values by character.
+        
+        The diff is cut short, returning a coarser result, once it has taken
+        `timeout` seconds, which defaults to `REVERSION_DIFF_TIMEOUT`.  A
+        timeout of zero never cuts the diff short.
+        """
+        return diff_values_before(old_value, new_value, mode, get_deadline(timeout))
+    
+    def diff_values_before(old_value, new_value, mode, deadline):
+        """
+        Generates a diff array between the two field values, as `diff_values`,
+        cutting it short at the given deadline.
+        """
+        if mode == DIFF_STRUCTURE:
+            old_text, new_text = format_structure(old_value), format_structure(new_value)
+            return diff_lines(force_unicode(old_text), force_unicode(new_text), deadline)
+        old_text, new_text = force_unicode(old_value), force_unicode(new_value)
+        if mode is None:
+            if len(old_text) + len(new_text) > DIFF_SIZE_LIMIT:
+                mode = DIFF_LINES
+            else:
+                mode = DIFF_CHARS
+        if mode == DIFF_LINES:
+            return diff_lines(old_text, new_text, deadline)
+        if mode == DIFF_CHARS:
+            return dmp.diff_main(old_text, new_text, True, deadline)
+        raise ValueError("Unknown diff mode %r." % mode)
+    
+    def get_version_hash(version):
+        """Returns the content hash of the given version."""
+        return version.content_hash or get_content_hash(version.get_serialized_data())
+    
+    def get_diff_cache_key(old_version, new_version, field_name, mode=None, timeout=None):
+        """
+        Returns the key that the rendered differences of the named field
+        between the two versions are cached under.
+        """
+        # The content hashes guard against rewritten rows and primary keys
+        # reused after deletion.  Versions saved before content hashes were
+        # recorded are hashed from their data.
+        key = "%s:%s:%s:%s:%s:%s:%s" % (old_version.pk, get_version_hash(old_version),
+                                        new_version.pk, get_version_hash(new_version),
+                                        field_name, mode, timeout)
+        return "reversion.diff.%s" % hashlib.md5(smart_str(key)).hexdigest()
+    
+    def generate_patches_html(old_version, new_version, field_names, mode=None, timeout=None):
+        """
+        Returns a dictionary mapping each of the named fields to a pretty html
+        version of its differences between the two versions.
+        
+        Rendered differences are cached, and the versions are only deserialized
+        if some of them are missing from the cache.  Fields that are equal in
+        both versions are rendered without being diffed.  The `mode` and
+        `timeout` are as for `diff_values`.
+        """
+        cache_keys = dict([(get_diff_cache_key(old_version, new_version, field_name, mode, timeout), field_name)
+                           for field_name in field_names])
+        patches = dict([(cache_keys[cache_key], patch)
+                        for cache_key, patch in diff_cache.get_many(cache_keys.keys()).items()])
+        missing_patches = {}
+        for cache_key, field_name in cache_keys.items():
+            if field_name in patches:
+                continue
+            Version.objects.prefetch_field_dicts([old_version, new_version])
+            old_value = old_version.field_dict[field_name]
+            new_value = new_version.field_dict[field_name]
+            deadline = get_deadline(timeout)
+            if old_value == new_value:
+                diffs = [(diff_match_patch.DIFF_EQUAL, force_unicode(new_value))]
+            else:
+                diffs = diff_values_before(old_value, new_value, mode, deadline)
+            patch = dmp.diff_prettyHtml(diffs)
+            patches[field_name] = patch
+            # A diff cut short by its deadline is not cached, so it is retried.
+            if time.time() < deadline:
+                missing_patches[cache_key] = patch
+        if missing_patches:
+            diff_cache.set_many(missing_patches, DIFF_CACHE_TIMEOUT)
+        return patches
+
+    def generate_diffs(old_version, new_version, field_name, mode=None, timeout=None):
+        """
+        Generates a diff array for the named field between the two versions.
+        The `mode` and `timeout` are as for `diff_values`.
+        """
+        return diff_values(old_version.field_dict[field_name],
+                           new_version.field_dict[field_name],
+                           mode, timeout)
+    
+    def generate_patch(old_version, new_version, field_name, mode=None, timeout=None):
         """
         Generates a text patch of the named field between the two versions.
         """
-        diffs = generate_diffs(old_version, new_version, field_name)
+        diffs = generate_diffs(old_version, new_version, field_name, mode, timeout)
         patch = dmp.patch_make(diffs)
         return dmp.patch_toText(patch)
     
-    def generate_patch_html(old_version, new_version, field_name):
+    def generate_patch_html(old_version, new_version, field_name, mode=None, timeout=None):
         """
         Generates a pretty html version of the differences between the named 
         field in two versions.
         """
-        diffs = generate_diffs(old_version, new_version, field_name)
+        diffs = generate_diffs(old_version, new_version, field_name, mode, timeout)
         return dmp.diff_prettyHtml(diffs)
     
@@ -1,2 +1,76 @@
-# post_syncdb.connect(create_initial_revisions)
+"""Database setup for Reversion."""
+
+
+from django.conf import settings
+from django.db import connections, transaction, DatabaseError, DEFAULT_DB_ALIAS
+from django.db.backends.util import truncate_name
+from django.db.models.signals import post_syncdb
+
+from reversion import models as reversion_app
+from reversion.models import Version
+
+
+# Composite indexes matching the hot Version lookups, as tuples of field names.
+VERSION_INDEXES = (("content_type", "object_id", "id"),
+                   ("content_type", "object_id", "is_latest"),
+                   ("content_type", "is_deleted", "id"),)
+
+
+# The number of leading characters of text columns that MySQL indexes, as it
+# cannot index whole text columns.
+TEXT_INDEX_LENGTH = 191
 
+
+def get_index_column(connection, field):
+    """
+    Returns the sql naming the column of the given field in an index, or None
+    if the backend cannot index the column.
+    """
+    backend_name = connection.settings_dict["ENGINE"].split(".")[-1]
+    column = connection.ops.quote_name(field.column)
+    if field.get_internal_type() == "TextField":
+        if backend_name == "mysql":
+            return "%s(%d)" % (column, TEXT_INDEX_LENGTH)
+        if backend_name == "oracle":
+            return None
+    return column
+
+
+def create_version_indexes(sender, created_models, db=DEFAULT_DB_ALIAS, **kwargs):
+    """
+    Creates the composite indexes of the Version table when syncdb creates it,
+    unless they already exist.
+    
+    The columns are read from the model, so the indexes follow the content
+    type column used when `REVERSION_USE_MULTI_DB` is set.  Text columns are
+    indexed by a prefix on MySQL, and indexes on them are skipped on Oracle.  Projects using
+    South get these indexes from the reversion migrations instead.
+    """
+    if not Version in created_models or "south" in settings.INSTALLED_APPS:
+        return
+    connection = connections[db]
+    qn = connection.ops.quote_name
+    opts = Version._meta
+    cursor = connection.cursor()
+    for field_names in VERSION_INDEXES:
+        fields = [opts.get_field(field_name) for field_name in field_names]
+        index_columns = [get_index_column(connection, field) for field in fields]
+        if None in index_columns:
+            continue
+        index_name = truncate_name("%s_%s" % (opts.db_table, "_".join([field.column for field in fields])), connection.ops.max_name_length())
+        # Flushing the database sends the same signal, with the indexes present.
+        sid = transaction.savepoint(using=db)
+        try:
+            cursor.execute("CREATE INDEX %s ON %s (%s)" % (qn(index_name),
+                                                           qn(opts.db_table),
+                                                           ", ".join(index_columns)))
+        except DatabaseError:
+            transaction.savepoint_rollback(sid, using=db)
+        else:
+            transaction.savepoint_commit(sid, using=db)
+    transaction.commit_unless_managed(using=db)
+
+
+post_syncdb.connect(create_version_indexes, sender=reversion_app)
+
+# post_syncdb.connect(create_initial_revisions)
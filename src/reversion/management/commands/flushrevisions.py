@@ -0,0 +1,17 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from reversion.revisions import revision, DEFAULT_FLUSH_CHUNK_SIZE
+
+class Command(BaseCommand):
+    help = 'Saves the revisions queued by the deferred revision mode, oldest first.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--chunk-size', '-c', action='store', dest='chunk_size',
+            default=str(DEFAULT_FLUSH_CHUNK_SIZE), help='Number of queued revisions to save in each transaction.'),
+    )
+
+    def handle(self, *args, **options):
+        chunk_size = max(1, int(options['chunk_size']))
+        count = revision.flush(chunk_size)
+        print "Saved %d queued revisions." % count
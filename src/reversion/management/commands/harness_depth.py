@@ -20,6 +20,8 @@ class Command(BaseCommand):
     option_list = BaseCommand.option_list + (
         make_option('--number', '-n', action='store', dest='number',
             default='2000', help='Number of revisions to attempt to create.'),
+        make_option('--ignore-duplicates', action='store_true', dest='ignore_duplicates',
+            default=False, help='Register the models so that unchanged versions are not saved.'),
     )
 
     def handle(self, *apps, **options):
@@ -34,7 +36,7 @@ class Command(BaseCommand):
         comment = hashlib.md5(str(datetime.datetime.now())).hexdigest()
         print "About to create %d revisions of %d models." % (number, len(models))
         print "to remove these revisions, use Revision.objects.filter(comment='%s').delete()" % comment
-        [revision.register(model) for model, creation in models]
+        [revision.register(model, ignore_duplicates=options['ignore_duplicates']) for model, creation in models]
 
         for i in range(number):
             for model, pk in models:
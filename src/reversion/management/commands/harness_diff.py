@@ -0,0 +1,72 @@
+import random
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+class Command(BaseCommand):
+    help = 'Times the diff modes over synthetic text and json fields of increasing size.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--sizes', '-s', action='store', dest='sizes',
+            default='10000,100000,1000000,10000000', help='Comma separated sizes, in characters, of the synthetic fields.'),
+        make_option('--modes', '-m', action='store', dest='modes',
+            default='chars,lines,structure', help='Comma separated diff modes to time.'),
+        make_option('--changes', '-c', action='store', dest='changes',
+            default='0.01', help='Fraction of the lines or items changed between the two versions.'),
+        make_option('--timeout', '-t', action='store', dest='timeout',
+            default=None, help='Diff timeout in seconds, defaulting to REVERSION_DIFF_TIMEOUT.'),
+    )
+
+    def make_text(self, size, changes, rnd):
+        """Returns an old and new text of about the given size, as lines of words."""
+        words = ['alpha', 'beta', 'gamma', 'delta', 'epsilon', 'zeta', 'eta', 'theta']
+        old_lines, new_lines = [], []
+        length = 0
+        while length < size:
+            line = u' '.join([rnd.choice(words) for i in xrange(10)]) + u'\n'
+            old_lines.append(line)
+            if rnd.random() < changes:
+                line = line.replace(rnd.choice(words), rnd.choice(words), 1)
+            new_lines.append(line)
+            length += len(line)
+        return u''.join(old_lines), u''.join(new_lines)
+
+    def make_structure(self, size, changes, rnd):
+        """Returns an old and new dict of about the given size when dumped as json."""
+        old_value, new_value = {}, {}
+        # Each item dumps to roughly 40 characters.
+        for i in xrange(max(size // 40, 1)):
+            key = u'key%08d' % i
+            item = [i, u'value%d' % rnd.randint(0, 1000000)]
+            old_value[key] = item
+            if rnd.random() < changes:
+                item = [i, u'value%d' % rnd.randint(0, 1000000)]
+            new_value[key] = item
+        return old_value, new_value
+
+    def handle(self, *args, **options):
+        try:
+            from reversion.helpers import diff_values, DIFF_STRUCTURE
+        except ImportError:
+            raise CommandError('The diff_match_patch library is not installed.')
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        modes = options['modes'].split(',')
+        changes = float(options['changes'])
+        timeout = float(options['timeout']) if options['timeout'] is not None else None
+        print "%10s %10s %10s %10s %10s" % ('size', 'mode', 'seconds', 'diffs', 'changed')
+        for size in sizes:
+            rnd = random.Random(size)
+            texts = self.make_text(size, changes, rnd)
+            structures = self.make_structure(size, changes, rnd)
+            for mode in modes:
+                if mode == DIFF_STRUCTURE:
+                    old_value, new_value = structures
+                else:
+                    old_value, new_value = texts
+                start = time.time()
+                diffs = diff_values(old_value, new_value, mode, timeout)
+                elapsed = time.time() - start
+                # A diff cut short by the timeout reports long changed runs.
+                changed = sum([len(text) for operation, text in diffs if operation])
+                print "%10d %10s %10.3f %10d %10d" % (size, mode, elapsed, len(diffs), changed)
@@ -0,0 +1,92 @@
+import sys
+import time
+import datetime
+from optparse import make_option
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db import connections, router, transaction
+from reversion.bulk import bulk_insert
+from reversion.models import Revision, Version
+
+class Command(BaseCommand):
+    help = 'Prints the query plans and timings of the hot Version lookups, optionally populating synthetic versions first.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--number', '-n', action='store', dest='number',
+            default='0', help='Number of synthetic versions to create before explaining the queries.'),
+        make_option('--objects', '-o', action='store', dest='objects',
+            default='10000', help='Number of distinct objects to spread the synthetic versions over.'),
+    )
+
+    def populate(self, number, objects):
+        """Creates synthetic versions of Revision objects, in chunks."""
+        content_type = ContentType.objects.get_for_model(Revision)
+        revision = Revision.objects.create(comment='harness_plans')
+        chunk = []
+        for i in xrange(number):
+            object_id = unicode(i % objects)
+            is_latest = i >= number - objects
+            chunk.append(Version(revision=revision,
+                                 object_id=object_id,
+                                 content_type=content_type,
+                                 format='json',
+                                 serialized_data='[]',
+                                 object_repr=object_id,
+                                 is_latest=is_latest,
+                                 is_deleted=is_latest and i % 10 == 0))
+            if len(chunk) == 10000:
+                bulk_insert(Version, chunk)
+                chunk = []
+                sys.stdout.write('.')
+                sys.stdout.flush()
+        bulk_insert(Version, chunk)
+        transaction.commit_unless_managed()
+        print
+        print "to remove these versions, use Revision.objects.filter(comment='harness_plans').delete()"
+
+    def explain(self, label, queryset):
+        """Prints the query plan and execution time of the given queryset."""
+        using = router.db_for_read(Version)
+        connection = connections[using]
+        sql, params = queryset.query.get_compiler(using).as_sql()
+        if 'sqlite' in connection.settings_dict['ENGINE']:
+            explain = 'EXPLAIN QUERY PLAN '
+        else:
+            explain = 'EXPLAIN '
+        cursor = connection.cursor()
+        cursor.execute(explain + sql, params)
+        plan = cursor.fetchall()
+        start = time.time()
+        list(queryset)
+        duration = time.time() - start
+        print label
+        print '    %s' % (sql % tuple([repr(param) for param in params]))
+        for row in plan:
+            print '    %s' % ' | '.join([unicode(column) for column in row])
+        print '    %.2fms' % (duration * 1000)
+        print
+
+    def handle(self, *args, **options):
+        number = int(options['number'])
+        objects = max(1, int(options['objects']))
+        if number:
+            print "About to create %d versions of %d objects." % (number, objects)
+            self.populate(number, objects)
+        content_type = ContentType.objects.get_for_model(Revision)
+        object_id = unicode(objects // 2)
+        print "Explaining queries over %d versions." % Version.objects.count()
+        print
+        self.explain('get_for_object_reference',
+            Version.objects.get_for_object_reference(Revision, object_id))
+        self.explain('get_for_date (latest version)',
+            Version.objects.filter(content_type=content_type, object_id=object_id, is_latest=True).select_related('revision')[:1])
+        self.explain('get_for_date (earlier version)',
+            Version.objects.get_for_object_reference(Revision, object_id).filter(revision__date_created__lte=datetime.datetime.now()).order_by('-pk')[:1])
+        self.explain('get_deleted_object',
+            Version.objects.filter(content_type=content_type, object_id=object_id, is_latest=True)[:1])
+        self.explain('get_deleted',
+            Version.objects.get_deleted(Revision)[:20])
+        self.explain('post_delete_receiver',
+            Version.objects.filter(content_type=content_type, object_id=object_id, is_latest=True))
+        print "finished."
@@ -0,0 +1,39 @@
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import router, transaction
+from reversion.models import Version
+from reversion.serialization import get_content_hash
+
+class Command(BaseCommand):
+    help = 'Records the content hash of stored versions saved before content hashes were introduced, in chunks.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--chunk-size', '-c', action='store', dest='chunk_size',
+            default='500', help='Number of versions to hash in each transaction.'),
+    )
+
+    def hash_versions(self, chunk, using):
+        """Records the content hash of the given versions."""
+        Version.objects.db_manager(using).prefetch_serialized_data(chunk)
+        for version in chunk:
+            Version.objects.using(using).filter(pk=version.pk).update(content_hash=get_content_hash(version.get_serialized_data()))
+
+    def handle(self, *args, **options):
+        chunk_size = max(1, int(options['chunk_size']))
+        using = router.db_for_write(Version)
+        queryset = Version.objects.using(using).filter(content_hash='').order_by('pk')
+        last_pk = 0
+        count = 0
+        while True:
+            chunk = list(queryset.filter(pk__gt=last_pk)[:chunk_size])
+            if not chunk:
+                break
+            transaction.commit_on_success(using=using)(self.hash_versions)(chunk, using)
+            last_pk = chunk[-1].pk
+            count += len(chunk)
+            sys.stdout.write('.')
+            sys.stdout.flush()
+        print
+        print "Hashed %d versions." % count
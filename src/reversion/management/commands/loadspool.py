@@ -0,0 +1,19 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from reversion.revisions import revision, DEFAULT_FLUSH_CHUNK_SIZE
+
+class Command(BaseCommand):
+    help = 'Saves the revisions captured in the spool file set by REVERSION_SPOOL_PATH, oldest first.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--chunk-size', '-c', action='store', dest='chunk_size',
+            default=str(DEFAULT_FLUSH_CHUNK_SIZE), help='Number of spooled revisions to save in each transaction.'),
+    )
+
+    def handle(self, *args, **options):
+        if revision.spool is None:
+            raise CommandError('No spool has been configured with REVERSION_SPOOL_PATH.')
+        chunk_size = max(1, int(options['chunk_size']))
+        count = revision.load_spool(chunk_size)
+        print "Loaded %d spooled revisions." % count
@@ -0,0 +1,65 @@
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import router, transaction
+from reversion import encodings
+from reversion.models import Version
+
+class Command(BaseCommand):
+    help = 'Re-encodes the serialized data of stored versions, in chunks, so that existing history can be compressed.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--encoding', '-e', action='store', dest='encoding',
+            default=None, help='The encoding to store the versions with. Defaults to REVERSION_ENCODING, for versions over REVERSION_ENCODING_THRESHOLD.'),
+        make_option('--chunk-size', '-c', action='store', dest='chunk_size',
+            default='500', help='Number of versions to re-encode in each transaction.'),
+    )
+
+    def recompress(self, chunk, encoding, using):
+        """
+        Re-encodes the given (pk, encoding, serialized_data) rows, choosing the
+        encoding of each row if no encoding is given.  Returns the number of
+        rows re-encoded.
+        """
+        count = 0
+        for pk, old_encoding, serialized_data in chunk:
+            serialized_data = encodings.decode(serialized_data, old_encoding)
+            new_encoding = encoding
+            if new_encoding is None:
+                new_encoding = encodings.get_storage_encoding(serialized_data)
+            if new_encoding == old_encoding:
+                continue
+            Version.objects.using(using).filter(pk=pk).update(encoding=new_encoding,
+                                                              serialized_data=encodings.encode(serialized_data, new_encoding))
+            count += 1
+        return count
+
+    def handle(self, *args, **options):
+        encoding = options['encoding']
+        try:
+            if encoding is None:
+                encodings.get_encoding(encodings.DEFAULT_ENCODING)
+            else:
+                encodings.get_encoding(encoding)
+        except encodings.EncodingError, ex:
+            raise CommandError(str(ex))
+        chunk_size = max(1, int(options['chunk_size']))
+        using = router.db_for_write(Version)
+        # Versions are walked in primary key order, so the command can be
+        # interrupted and resumed without revisiting converted rows.
+        queryset = Version.objects.using(using).order_by('pk')
+        if encoding is not None:
+            queryset = queryset.exclude(encoding=encoding)
+        last_pk = 0
+        count = 0
+        while True:
+            chunk = list(queryset.filter(pk__gt=last_pk).values_list('pk', 'encoding', 'serialized_data')[:chunk_size])
+            if not chunk:
+                break
+            count += transaction.commit_on_success(using=using)(self.recompress)(chunk, encoding, using)
+            last_pk = chunk[-1][0]
+            sys.stdout.write('.')
+            sys.stdout.flush()
+        print
+        print "Re-encoded %d versions." % count
@@ -1,8 +1,22 @@
 """Model managers for Reversion."""
 
 
-from django.contrib.contenttypes.models import ContentType
+import operator
+
 from django.db import models
+from django.db.models.query import QuerySet
+
+from reversion import deltas, encodings, fields
+from reversion.bulk import MAX_QUERY_PARAMS, chunked
+from reversion.caches import content_type_cache
+from reversion.serialization import get_content_hash
+
+
+# The number of versions fetched at a time when iterating over history.
+DEFAULT_CHUNK_SIZE = 500
+
+# The number of versions on each page of history.
+DEFAULT_PAGE_SIZE = 20
 
 
 class VersionManager(models.Manager):
@@ -11,32 +25,317 @@ class VersionManager(models.Manager):
     
     def get_for_object_reference(self, model, object_id):
         """Returns all versions for the given object reference."""
-        content_type = ContentType.objects.get_for_model(model)
+        content_type = content_type_cache.get_for_model(model)
         object_id = unicode(object_id)
         versions = self.filter(content_type=content_type, object_id=object_id)
         versions = versions.order_by("pk")
         return versions
     
+    def get_for_object_references(self, references):
+        """
+        Returns all versions for the given sequence of (content_type, object_id)
+        pairs, using a single query.
+        """
+        object_ids = {}
+        for content_type, object_id in references:
+            object_ids.setdefault(content_type, set()).add(unicode(object_id))
+        if not object_ids:
+            return self.none()
+        return self.filter(reduce(operator.or_, [models.Q(content_type=content_type, object_id__in=list(ids))
+                                                 for content_type, ids in object_ids.items()]))
+    
+    def get_latest_values(self, references, *fields):
+        """
+        Returns a list of (content_type, object_id, value, ...) tuples holding
+        the given fields of the latest version of each of the given
+        (content_type, object_id) pairs.
+        
+        One query is used per chunk of objects of each content type.
+        """
+        object_ids = {}
+        for content_type, object_id in references:
+            object_ids.setdefault(content_type, set()).add(unicode(object_id))
+        latest_values = []
+        for content_type, ids in object_ids.items():
+            for chunk in chunked(ids, MAX_QUERY_PARAMS - 2):
+                versions = self.filter(content_type=content_type, object_id__in=chunk, is_latest=True)
+                for values in versions.values_list("object_id", *fields):
+                    latest_values.append((content_type,) + values)
+        return latest_values
+    
+    def mark_deleted(self, references):
+        """
+        Marks the latest versions of the given (content_type, object_id) pairs
+        as deletions, using one update per chunk of objects of each content
+        type.
+        """
+        object_ids = {}
+        for content_type, object_id in references:
+            object_ids.setdefault(content_type, set()).add(unicode(object_id))
+        for content_type, ids in object_ids.items():
+            for chunk in chunked(ids, MAX_QUERY_PARAMS - 2):
+                self.filter(content_type=content_type, object_id__in=chunk, is_latest=True).update(is_deleted=True)
+    
     def get_for_object(self, object):
         """
         Returns all the versions of the given object, ordered by date created.
         """
         return self.get_for_object_reference(object.__class__, object.pk)
     
+    def iter_chunked(self, versions, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Iterates over the given versions in primary key order, fetching them in
+        chunks of `chunk_size` using a keyset on the primary key.
+        
+        The serialized data of each version is deferred until it is accessed,
+        so iterating over a long history runs in constant memory.
+        """
+        versions = versions.defer("serialized_data").order_by("pk")
+        last_pk = 0
+        while True:
+            chunk = list(versions.filter(pk__gt=last_pk)[:chunk_size])
+            for version in chunk:
+                yield version
+            if len(chunk) < chunk_size:
+                break
+            last_pk = chunk[-1].pk
+    
+    def iter_for_object_reference(self, model, object_id, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Iterates over all versions for the given object reference, in chunks."""
+        return self.iter_chunked(self.get_for_object_reference(model, object_id), chunk_size)
+    
+    def iter_for_object(self, object, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Iterates over all the versions of the given object, in chunks."""
+        return self.iter_for_object_reference(object.__class__, object.pk, chunk_size)
+    
+    def iter_for_model(self, model_class, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Iterates over all the versions of the given model class, in chunks."""
+        content_type = content_type_cache.get_for_model(model_class)
+        return self.iter_chunked(self.filter(content_type=content_type), chunk_size)
+    
+    def get_page_for_object_reference(self, model, object_id, after=None, page_size=DEFAULT_PAGE_SIZE):
+        """
+        Returns a tuple of (versions, has_more), holding a page of the versions
+        of the given object reference, newest first.
+        
+        Pages are selected by a keyset on the date of the revision and the
+        primary key of the version, so each page costs the same however deep
+        into the history it is.  The next page starts after the primary key of
+        the last version of the previous page, given as `after`.  Revisions are
+        fetched with the versions, and serialized data is deferred.
+        """
+        versions = self.get_for_object_reference(model, object_id)
+        if after is not None:
+            try:
+                after_date = self.filter(pk=after).values_list("revision__date_created", flat=True)[0]
+            except IndexError:
+                raise self.model.DoesNotExist
+            versions = versions.filter(models.Q(revision__date_created__lt=after_date) |
+                                       models.Q(revision__date_created=after_date, pk__lt=after))
+        related_fields = ["revision"]
+        # Natural keys cannot be joined.
+        if not isinstance(self.model._meta.get_field("revision").rel.to._meta.get_field("user"), fields.NaturalKey):
+            related_fields.append("revision__user")
+        versions = versions.select_related(*related_fields).defer("serialized_data")
+        versions = list(versions.order_by("-revision__date_created", "-pk")[:page_size + 1])
+        return versions[:page_size], len(versions) > page_size
+    
+    def get_delta_chains(self, keyframe_ids):
+        """
+        Returns a dictionary mapping each of the given keyframe ids to the
+        ordered list of (pk, serialized_data) pairs of its delta chain, starting
+        with the keyframe itself.  The serialized data is decoded, but deltas are
+        not replayed.
+        """
+        chains = {}
+        for chunk in chunked(set(keyframe_ids), MAX_QUERY_PARAMS // 2):
+            versions = self.filter(models.Q(pk__in=chunk) | models.Q(keyframe_id__in=chunk))
+            versions = versions.order_by("pk").values_list("pk", "keyframe_id", "encoding", "serialized_data")
+            for pk, keyframe_id, encoding, serialized_data in versions:
+                chains.setdefault(keyframe_id or pk, []).append((pk, encodings.decode(serialized_data, encoding)))
+        return chains
+    
+    def prefetch_serialized_data(self, versions):
+        """
+        Rebuilds the full serialized data of the delta versions in the given
+        sequence, fetching all of their delta chains at once.
+        """
+        versions = [version for version in versions
+                    if version.keyframe_id is not None and not hasattr(version, "_serialized_data_cache")]
+        if not versions:
+            return
+        chains = self.get_delta_chains([version.keyframe_id for version in versions])
+        for version in versions:
+            chain = [serialized_data for pk, serialized_data in chains[version.keyframe_id]
+                     if pk <= version.pk]
+            version._serialized_data_cache = deltas.replay(chain[0], chain[1:])
+    
+    def prefetch_field_dicts(self, versions):
+        """
+        Fills in the field dictionaries of the given versions.
+        
+        The versions of the parent models of the given versions are fetched with
+        one query per parent model at each level of inheritance, rather than one
+        query per parent of every version.
+        """
+        versions = [version for version in versions if not hasattr(version, "_field_dict_cache")]
+        object_versions = {}
+        parent_versions = {}
+        levels = []
+        pending = versions
+        while pending:
+            levels.append(pending)
+            self.prefetch_serialized_data(pending)
+            # Group the parent references of this level by parent model.
+            references = {}
+            for version in pending:
+                object_version = version.object_version
+                object_versions[id(version)] = object_version
+                parent_versions[id(version)] = []
+                obj = object_version.object
+                for parent_class, field in obj._meta.parents.items():
+                    if field:
+                        parent_id = unicode(getattr(obj, field.attname))
+                    else:
+                        parent_id = unicode(obj.pk)
+                    references.setdefault(parent_class, {}).setdefault((version.revision_id, parent_id), []).append(version)
+            # Fetch the parent versions of this level.
+            pending = []
+            for parent_class, children in references.items():
+                content_type = content_type_cache.get_for_model(parent_class)
+                for chunk in chunked(children.keys(), MAX_QUERY_PARAMS // 2 - 1):
+                    parents = self.filter(content_type=content_type,
+                                          revision__in=set([revision_id for revision_id, object_id in chunk]),
+                                          object_id__in=set([object_id for revision_id, object_id in chunk]))
+                    for parent_version in parents:
+                        child_versions = children.get((parent_version.revision_id, parent_version.object_id))
+                        if child_versions:
+                            for child_version in child_versions:
+                                parent_versions[id(child_version)].append(parent_version)
+                            pending.append(parent_version)
+        # Build the field dictionaries, starting with the most distant parents.
+        for level in reversed(levels):
+            for version in level:
+                object_version = object_versions[id(version)]
+                obj = object_version.object
+                result = {}
+                for field in obj._meta.fields:
+                    result[field.name] = field.value_from_object(obj)
+                result.update(object_version.m2m_data)
+                # Add parent data.
+                for parent_version in parent_versions[id(version)]:
+                    result.update(parent_version._field_dict_cache)
+                version._field_dict_cache = result
+    
     def get_unique_for_object(self,obj):
-        """Returns unique versions associated with the object."""
-        versions = self.get_for_object(obj)
+        """
+        Returns unique versions associated with the object.
+        
+        Versions are compared by their content hash, so serialized data is only
+        loaded for versions saved before content hashes were recorded.
+        """
+        versions = self.get_for_object(obj).defer("serialized_data")
         changed_versions = []
-        last_serialized_data = None
+        last_content_hash = None
         for version in versions:
-            if last_serialized_data != version.serialized_data:
+            content_hash = version.content_hash or get_content_hash(version.get_serialized_data())
+            if last_content_hash != content_hash:
                 changed_versions.append(version)
-            last_serialized_data = version.serialized_data
+            last_content_hash = content_hash
         return changed_versions
     
+    def get_equal_for_version(self, version):
+        """
+        Returns all the versions of the same object that are equal to the given
+        version, compared by content hash.
+        """
+        content_type = content_type_cache.get_content_type(version.get_content_type_value())
+        return self.filter(content_type=content_type,
+                           object_id=version.object_id,
+                           content_hash=version.content_hash).order_by("pk")
+    
+    def has_changed_between(self, revision, other_revision):
+        """
+        Checks whether any object was added, removed or changed between the
+        two given revisions.
+        
+        Versions are compared by content hash in the database, with a grouped
+        query that finds the objects whose hashed versions do not match.  Only
+        those objects, and objects with versions saved before content hashes
+        were recorded, are loaded and compared in Python, hashing the data of
+        versions without a content hash.
+        
+        An object with a version in only one of the revisions was added or
+        removed, unless its model is registered with `ignore_duplicates`.
+        Unchanged objects of those models may have been skipped, so the object
+        is compared with its latest version as of the other revision instead.
+        """
+        from reversion.revisions import revision as revision_manager
+        revision_ids = (getattr(revision, "pk", revision), getattr(other_revision, "pk", other_revision))
+        if revision_ids[0] == revision_ids[1]:
+            return False
+        versions = self.filter(revision__in=revision_ids)
+        # Each object has at most one version in each revision, so a hash held
+        # by a single version is not matched by the other revision.
+        unmatched_versions = versions.exclude(content_hash="").values("content_type", "object_id", "content_hash")
+        unmatched_versions = unmatched_versions.annotate(version_count=models.Count("pk")).filter(version_count=1)
+        object_ids = {}
+        for values in unmatched_versions:
+            object_ids.setdefault(values["content_type"], set()).add(values["object_id"])
+        for content_type_value, object_id in versions.filter(content_hash="").values_list("content_type", "object_id"):
+            object_ids.setdefault(content_type_value, set()).add(object_id)
+        if not object_ids:
+            return False
+        # Compare the remaining objects in Python.
+        versions_by_revision = dict([(revision_id, {}) for revision_id in revision_ids])
+        for content_type_value, ids in object_ids.items():
+            content_type = content_type_cache.get_content_type(content_type_value)
+            for chunk in chunked(ids, MAX_QUERY_PARAMS - 3):
+                for version in versions.filter(content_type=content_type, object_id__in=chunk).defer("serialized_data"):
+                    versions_by_revision[version.revision_id][(content_type_value, version.object_id)] = version
+        # Find the objects with no version in one of the revisions.
+        for revision_id, other_revision_id in (revision_ids, revision_ids[::-1]):
+            missing_object_ids = {}
+            for content_type_value, object_id in versions_by_revision[other_revision_id]:
+                if (content_type_value, object_id) in versions_by_revision[revision_id]:
+                    continue
+                model = content_type_cache.get_model(content_type_value)
+                if not (revision_manager.is_registered(model) and
+                        revision_manager.get_registration_info(model).ignore_duplicates):
+                    return True
+                missing_object_ids.setdefault(content_type_value, []).append(object_id)
+            # Use the latest version of each object as of the revision.
+            for content_type_value, ids in missing_object_ids.items():
+                content_type = content_type_cache.get_content_type(content_type_value)
+                for chunk in chunked(ids, MAX_QUERY_PARAMS - 3):
+                    previous_versions = self.filter(content_type=content_type, object_id__in=chunk, revision__pk__lte=revision_id)
+                    previous_versions = previous_versions.values("object_id").annotate(previous_pk=models.Max("pk"))
+                    previous_pks = list(previous_versions.values_list("previous_pk", flat=True))
+                    for version in self.filter(pk__in=previous_pks).defer("serialized_data"):
+                        versions_by_revision[revision_id][(content_type_value, version.object_id)] = version
+        # Objects with no version as of one of the revisions were added.
+        if set(versions_by_revision[revision_ids[0]]) != set(versions_by_revision[revision_ids[1]]):
+            return True
+        self.prefetch_serialized_data([version for revision_versions in versions_by_revision.values()
+                                       for version in revision_versions.values() if not version.content_hash])
+        for reference, version in versions_by_revision[revision_ids[0]].items():
+            other_version = versions_by_revision[revision_ids[1]][reference]
+            content_hash = version.content_hash or get_content_hash(version.get_serialized_data())
+            other_content_hash = other_version.content_hash or get_content_hash(other_version.get_serialized_data())
+            if content_hash != other_content_hash:
+                return True
+        return False
+    
     def get_for_date(self, object, date):
         """Returns the latest version of an object for the given date."""
         versions = self.get_for_object(object)
+        # Most lookups are for a recent date, so try the latest version first.
+        try:
+            latest_version = versions.filter(is_latest=True).select_related("revision")[0]
+        except IndexError:
+            raise self.model.DoesNotExist
+        if latest_version.revision.date_created <= date:
+            return latest_version
         versions = versions.filter(revision__date_created__lte=date)
         versions = versions.order_by("-pk")
         try:
@@ -46,6 +345,30 @@ class VersionManager(models.Manager):
         else:
             return version
     
+    def get_all_for_date(self, model_or_queryset, date):
+        """
+        Iterates over the latest version of every object of the given model, or
+        of every object in the given queryset, as of the given date.
+        
+        The versions are selected by a single grouped query per chunk of
+        objects, and are deserialized only when accessed.
+        """
+        if isinstance(model_or_queryset, QuerySet):
+            model = model_or_queryset.model
+            object_ids = [unicode(pk) for pk in model_or_queryset.values_list("pk", flat=True)]
+            object_id_chunks = chunked(object_ids, MAX_QUERY_PARAMS - 2)
+        else:
+            model = model_or_queryset
+            object_id_chunks = [None]
+        content_type = content_type_cache.get_for_model(model)
+        for object_ids in object_id_chunks:
+            versions = self.filter(content_type=content_type, revision__date_created__lte=date)
+            if object_ids is not None:
+                versions = versions.filter(object_id__in=object_ids)
+            latest_pks = versions.values("object_id").annotate(latest_pk=models.Max("pk")).values_list("latest_pk", flat=True)
+            for version in self.filter(pk__in=latest_pks).select_related("revision").order_by("pk").iterator():
+                yield version
+    
     def get_deleted_object(self, model_class, object_id, select_related=None):
         """
         Returns the version corresponding to the deletion of the object with
@@ -54,10 +377,9 @@ class VersionManager(models.Manager):
         You can specify a tuple of related fields to fetch using the
         `select_related` argument.
         """
-        content_type = ContentType.objects.get_for_model(model_class)
+        content_type = content_type_cache.get_for_model(model_class)
         object_id = unicode(object_id)
-        versions = self.filter(content_type=content_type, object_id=object_id)
-        versions = versions.order_by("-pk")
+        versions = self.filter(content_type=content_type, object_id=object_id, is_latest=True)
         if select_related:
             versions = versions.select_related(*select_related)
         try:
@@ -69,14 +391,35 @@ class VersionManager(models.Manager):
     
     def get_deleted(self, model_class, select_related=None):
         """
-        Returns all the deleted versions for the given model class.
+        Returns all the deleted versions for the given model class, most
+        recently deleted first.
         
         You can specify a tuple of related fields to fetch using the
         `select_related` argument.
         """
-
-
-        content_type = ContentType.objects.get_for_model(model_class)
-        return self.filter(content_type=content_type, is_deleted=True).order_by('-revision__date_created')
-        
+        content_type = content_type_cache.get_for_model(model_class)
+        # Versions are created in date order, so ordering by primary key uses
+        # the (content_type, is_deleted, id) index instead of a join.
+        versions = self.filter(content_type=content_type, is_deleted=True).order_by("-pk")
+        if select_related:
+            versions = versions.select_related(*select_related)
+        return versions
+    
+    def get_deleted_page(self, model_class, after=None, search=None, page_size=DEFAULT_PAGE_SIZE):
+        """
+        Returns a tuple of (versions, has_more), holding a page of the deleted
+        versions of the given model class, most recently deleted first.
         
+        Pages are selected by a keyset on the primary key, so the next page
+        starts after the primary key of the last version of the previous page,
+        given as `after`.  If `search` is given, only versions whose
+        representation contains it are returned.  Revisions are fetched with the
+        versions, and serialized data is deferred.
+        """
+        versions = self.get_deleted(model_class, select_related=("revision",)).defer("serialized_data")
+        if after is not None:
+            versions = versions.filter(pk__lt=after)
+        if search:
+            versions = versions.filter(object_repr__icontains=search)
+        versions = list(versions[:page_size + 1])
+        return versions[:page_size], len(versions) > page_size
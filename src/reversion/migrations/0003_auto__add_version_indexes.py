@@ -0,0 +1,114 @@
+# encoding: utf-8
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+# The number of leading characters of object_id that MySQL indexes, as it cannot
+# index whole text columns.
+OBJECT_ID_INDEX_LENGTH = 191
+
+
+def create_object_id_index(column_names):
+    """
+    Creates an index on the given columns of the Version table, including the
+    object_id text column.  Oracle cannot index text columns, so no index is
+    created there.
+    """
+    if db.backend_name == "mysql":
+        columns = [column_name == "object_id" and "%s(%d)" % (db.quote_name(column_name), OBJECT_ID_INDEX_LENGTH) or db.quote_name(column_name)
+                   for column_name in column_names]
+        db.execute("CREATE INDEX %s ON %s (%s)" % (db.quote_name(db.create_index_name('reversion_version', column_names)),
+                                                    db.quote_name('reversion_version'),
+                                                    ", ".join(columns)))
+    elif db.backend_name != "oracle":
+        db.create_index('reversion_version', column_names)
+
+
+class Migration(SchemaMigration):
+    
+    def forwards(self, orm):
+        
+        # Adding index on 'Version', fields ['content_type', 'object_id', 'id']
+        create_object_id_index(['content_type_id', 'object_id', 'id'])
+
+        # Adding index on 'Version', fields ['content_type', 'object_id', 'is_latest']
+        create_object_id_index(['content_type_id', 'object_id', 'is_latest'])
+
+        # Adding index on 'Version', fields ['content_type', 'is_deleted', 'id']
+        db.create_index('reversion_version', ['content_type_id', 'is_deleted', 'id'])
+    
+    
+    def backwards(self, orm):
+        
+        # Removing index on 'Version', fields ['content_type', 'is_deleted', 'id']
+        db.delete_index('reversion_version', ['content_type_id', 'is_deleted', 'id'])
+
+        if db.backend_name != "oracle":
+            # Removing index on 'Version', fields ['content_type', 'object_id', 'is_latest']
+            db.delete_index('reversion_version', ['content_type_id', 'object_id', 'is_latest'])
+
+            # Removing index on 'Version', fields ['content_type', 'object_id', 'id']
+            db.delete_index('reversion_version', ['content_type_id', 'object_id', 'id'])
+    
+    
+    models = {
+        'auth.group': {
+            'Meta': {'object_name': 'Group'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '80'}),
+            'permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'})
+        },
+        'auth.permission': {
+            'Meta': {'unique_together': "(('content_type', 'codename'),)", 'object_name': 'Permission'},
+            'codename': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        'auth.user': {
+            'Meta': {'object_name': 'User'},
+            'date_joined': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'blank': 'True'}),
+            'first_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'groups': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Group']", 'symmetrical': 'False', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True', 'blank': 'True'}),
+            'is_staff': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'blank': 'True'}),
+            'is_superuser': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'blank': 'True'}),
+            'last_login': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'last_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'user_permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'}),
+            'username': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '30'})
+        },
+        'contenttypes.contenttype': {
+            'Meta': {'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        'reversion.revision': {
+            'Meta': {'object_name': 'Revision'},
+            'comment': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'date_created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['auth.User']", 'null': 'True', 'blank': 'True'})
+        },
+        'reversion.version': {
+            'Meta': {'object_name': 'Version'},
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']"}),
+            'format': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_deleted': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'blank': 'True'}),
+            'is_latest': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'blank': 'True'}),
+            'object_id': ('django.db.models.fields.TextField', [], {'db_index': 'True'}),
+            'object_repr': ('django.db.models.fields.TextField', [], {}),
+            'revision': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['reversion.Revision']"}),
+            'serialized_data': ('django.db.models.fields.TextField', [], {})
+        }
+    }
+    
+    complete_apps = ['reversion']
@@ -5,10 +5,15 @@ from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.core import serializers
 from django.db import models
-from reversion import fields
-import reversion
+from django.db.models import Q
+from django.db.models.signals import pre_delete, post_delete
+from reversion import deltas, encodings, fields
+from reversion.bulk import MAX_QUERY_PARAMS, chunked
+from reversion.caches import content_type_cache, object_version_cache
 from reversion.managers import VersionManager
+from reversion.serialization import freeze_object_version, thaw_object_version
 from django.conf import settings
+from threading import local
 
 class ReversionUserManager(models.Manager):
 
@@ -77,20 +82,14 @@ class Revision(get_revision_base()):
                                help_text="A text comment on this revision.")
     
     def revert(self, delete=False):
-        """Reverts all objects in this revision."""
-        versions = self.version_set.all()
-        for version in versions:
-            version.revert()
-        if delete:
-            # Get a set of all objects in this revision.
-            old_revision_set = [ContentType.objects.get_for_id(version.content_type_id).get_object_for_this_type(pk=version.object_id)
-                                    for version in versions]
-            # Calculate the set of all objects that are in the revision now.
-            current_revision_set = reversion.revision.follow_relationships(old_revision_set)
-            # Delete objects that are no longer in the current revision.
-            for current_object in current_revision_set:
-                if not current_object in old_revision_set:
-                    current_object.delete()
+        """
+        Reverts all objects in this revision.
+        
+        If `delete` is True, objects that are related to this revision but were
+        not part of it are deleted.
+        """
+        from reversion.revisions import revision
+        revision.revert_versions(self.version_set.all(), delete)
             
     def __unicode__(self):
         """Returns a unicode representation."""
@@ -113,18 +112,85 @@ class Version(get_version_base()):
     format = models.CharField(max_length=255,
                               help_text="The serialization format used by this model.")
     
+    encoding = models.CharField(max_length=255,
+                                blank=True,
+                                default="",
+                                help_text="The encoding used to store the serialized data.")
+    
+    content_hash = models.CharField(max_length=40,
+                                    blank=True,
+                                    default="",
+                                    db_index=True,
+                                    help_text="A hash of the full serialized form of this version of the model.")
+    
     serialized_data = models.TextField(help_text="The serialized form of this version of the model.")
     
+    # Not a foreign key, so that deleting a keyframe does not cascade to its
+    # deltas.
+    keyframe_id = models.IntegerField(blank=True,
+                                      null=True,
+                                      db_index=True,
+                                      help_text="Primary key of the version that this delta is replayed from.")
+    
     object_repr = models.TextField(help_text="A string representation of the object.")
 
     is_deleted = models.BooleanField(default=False)
     
+    is_latest = models.BooleanField(default=False,
+                                    help_text="Whether this is the latest version of the model.")
+    
+    def get_content_type_value(self):
+        """
+        Returns the value stored for the content type of this version, which is
+        the content type id, or its natural key when `REVERSION_USE_MULTI_DB`
+        is set.
+        """
+        return getattr(self, self._meta.get_field("content_type").attname)
+    
+    def set_content_type_value(self, value):
+        """
+        Sets the content type of this version from its stored value, using the
+        process-wide content type cache.
+        """
+        field = self._meta.get_field("content_type")
+        setattr(self, field.attname, value)
+        setattr(self, field.get_cache_name(), content_type_cache.get_content_type(value))
+    
+    def get_serialized_data(self):
+        """
+        Returns the serialized form of this version, decoding it if required.
+        
+        If this version is stored as a delta, the full serialization is rebuilt
+        from the delta chain that ends with this version.
+        """
+        if self.keyframe_id is None:
+            return encodings.decode(self.serialized_data, self.encoding)
+        if not hasattr(self, "_serialized_data_cache"):
+            Version.objects.prefetch_serialized_data([self])
+        return self._serialized_data_cache
+    
     def get_object_version(self):
-        """Returns the stored version of the model."""
-        data = self.serialized_data
-        if isinstance(data, unicode):
-            data = data.encode("utf8")
-        return list(serializers.deserialize(self.format, data))[0]
+        """
+        Returns the stored version of the model.
+        
+        The deserialized version is memoized on this instance, and shared with
+        other instances of this version through the process-wide object version
+        cache, if one is configured with `REVERSION_OBJECT_CACHE_SIZE`.
+        """
+        if not hasattr(self, "_object_version_cache"):
+            cache_key = (self.pk, self.format, self.content_hash)
+            frozen_object_version = object_version_cache.get(cache_key)
+            if frozen_object_version is None:
+                data = self.get_serialized_data()
+                if isinstance(data, unicode):
+                    data = data.encode("utf8")
+                object_version = list(serializers.deserialize(self.format, data))[0]
+                if object_version_cache.size:
+                    object_version_cache.set(cache_key, freeze_object_version(object_version))
+            else:
+                object_version = thaw_object_version(frozen_object_version)
+            self._object_version_cache = object_version
+        return self._object_version_cache
     
     object_version = property(get_object_version,
                               doc="The stored version of the model.")
@@ -137,28 +203,7 @@ class Version(get_version_base()):
         This method will follow parent links, if present.
         """
         if not hasattr(self, "_field_dict_cache"):
-            object_version = self.object_version
-            obj = object_version.object
-            result = {}
-            for field in obj._meta.fields:
-                result[field.name] = field.value_from_object(obj)
-            result.update(object_version.m2m_data)
-            # Add parent data.
-            for parent_class, field in obj._meta.parents.items():
-                content_type = ContentType.objects.get_for_model(parent_class)
-                if field:
-                    parent_id = unicode(getattr(obj, field.attname))
-                else:
-                    parent_id = obj.pk
-                try:
-                    parent_version = Version.objects.get(revision__id=self.revision_id,
-                                                         content_type=content_type,
-                                                         object_id=parent_id)
-                except parent_class.DoesNotExist:
-                    pass
-                else:
-                    result.update(parent_version.get_field_dict())
-            setattr(self, "_field_dict_cache", result)
+            Version.objects.prefetch_field_dicts([self])
         return getattr(self, "_field_dict_cache")
        
     field_dict = property(get_field_dict,
@@ -167,9 +212,143 @@ class Version(get_version_base()):
     def revert(self):
         """Recovers the model in this version."""
         self.object_version.save()
-        
+
+    def delete(self, *args, **kwargs):
+        """
+        Deletes this version.
+
+        The latest flag and delta chain fields are reloaded first, as deleting
+        other versions of the object may have rewritten them since this version
+        was loaded.
+        """
+        try:
+            self.is_latest, self.keyframe_id, self.encoding, self.serialized_data = Version.objects.filter(pk=self.pk).values_list("is_latest", "keyframe_id", "encoding", "serialized_data")[0]
+        except IndexError:
+            pass
+        super(Version, self).delete(*args, **kwargs)
+
     def __unicode__(self):
         """Returns a unicode representation."""
         return self.object_repr
+
+
+class QueuedRevision(get_revision_base()):
+
+    """A revision captured in deferred mode, waiting to be saved."""
+
+    db_affinity = getattr(settings, 'REVERSION_DB', 'default')
+
+    date_created = models.DateTimeField(help_text="The date and time this revision was captured.")
+
+    comment = models.TextField(blank=True,
+                               help_text="A text comment on this revision.")
+
+    payload = models.TextField(help_text="The captured versions and deletions, as json.")
+
+
+class DeletedVersions(local):
+
+    """
+    The versions being deleted by the current delete, keyed by primary key.
     
+    Django sends pre_delete for every object of a delete before running any of
+    its SQL deletes, so the versions are collected as they are notified, and
+    handled together once the first of them has been deleted.
+    """
+
+    def __init__(self):
+        """Initializes the deleted versions."""
+        self.versions = {}
+
+
+deleted_versions = DeletedVersions()
+
+
+def collect_deleted_version(instance, **kwargs):
+    """Remembers the fields of a version that is about to be deleted."""
+    # Reading the fields loads any that were deferred, while the row exists.
+    deleted_versions.versions[instance.pk] = (instance.get_content_type_value(),
+                                              instance.object_id,
+                                              instance.is_latest,
+                                              instance.keyframe_id,
+                                              instance.format,
+                                              instance.encoding,
+                                              instance.serialized_data)
+
+def promote_latest_versions(versions):
+    """
+    Marks the previous version of each object as the latest when the latest
+    version of that object is deleted, using one grouped query and one update
+    per chunk of objects of each content type.
+    """
+    object_ids = {}
+    for content_type_value, object_id, is_latest, keyframe_id, format, encoding, serialized_data in versions.values():
+        if is_latest:
+            object_ids.setdefault(content_type_value, set()).add(object_id)
+    for content_type_value, ids in object_ids.items():
+        content_type = content_type_cache.get_content_type(content_type_value)
+        for chunk in chunked(ids, MAX_QUERY_PARAMS - 2):
+            previous_versions = Version.objects.filter(content_type=content_type, object_id__in=chunk)
+            previous_versions = list(previous_versions.values("object_id").annotate(previous_pk=models.Max("pk")).values_list("previous_pk", flat=True))
+            if previous_versions:
+                Version.objects.filter(pk__in=previous_versions).update(is_latest=True)
+
+def repair_delta_chains(versions):
+    """
+    Keeps the delta chains of the deleted versions readable.
     
+    If a deleted version is a keyframe, the next remaining version of its chain
+    is stored in full and becomes the keyframe of the rest of the chain.  The
+    changes of deleted deltas are merged into the next remaining delta.  The
+    chains are fetched with one query per chunk of keyframes, and only the
+    versions that change are updated.
+    """
+    versions = dict([(pk, (keyframe_id, encoding, serialized_data))
+                     for pk, (content_type_value, object_id, is_latest, keyframe_id, format, encoding, serialized_data) in versions.items()
+                     if format in deltas.DELTA_FORMATS])
+    chains = Version.objects.get_delta_chains([keyframe_id or pk for pk, (keyframe_id, encoding, serialized_data) in versions.items()])
+    # Versions that are still stored were not deleted, as their delete failed.
+    for chain in chains.values():
+        for pk, serialized_data in chain:
+            versions.pop(pk, None)
+    for pk, (keyframe_id, encoding, serialized_data) in versions.items():
+        if keyframe_id is None and pk in chains:
+            chains[pk].append((pk, encodings.decode(serialized_data, encoding)))
+        elif keyframe_id in chains:
+            chains[keyframe_id].append((pk, encodings.decode(serialized_data, encoding)))
+    for keyframe_id, chain in chains.items():
+        chain.sort()
+        next_keyframe_id = keyframe_id
+        merged_data = []
+        for pk, serialized_data in chain:
+            if pk in versions:
+                merged_data.append(serialized_data)
+            elif merged_data:
+                serialized_data = deltas.replay(merged_data[0], merged_data[1:] + [serialized_data])
+                merged_data = []
+                if next_keyframe_id in versions:
+                    Version.objects.filter(keyframe_id=keyframe_id).update(keyframe_id=pk)
+                    next_keyframe_id = pk
+                    update_keyframe_id = None
+                else:
+                    update_keyframe_id = next_keyframe_id
+                encoding = encodings.get_storage_encoding(serialized_data)
+                Version.objects.filter(pk=pk).update(keyframe_id=update_keyframe_id,
+                                                     encoding=encoding,
+                                                     serialized_data=encodings.encode(serialized_data, encoding))
+
+def handle_deleted_versions(instance, **kwargs):
+    """
+    Promotes the previous versions of the objects whose latest version was
+    deleted, and repairs the delta chains of the deleted versions, once for
+    all the versions of a delete.
+    """
+    if not instance.pk in deleted_versions.versions:
+        return
+    versions = deleted_versions.versions.copy()
+    deleted_versions.versions.clear()
+    promote_latest_versions(versions)
+    repair_delta_chains(versions)
+
+pre_delete.connect(collect_deleted_version, sender=Version)
+post_delete.connect(handle_deleted_versions, sender=Version)
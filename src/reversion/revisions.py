@@ -6,16 +6,26 @@ try:
 except ImportError:
     from django.utils.functional import wraps  # Python 2.3, 2.4 fallback.
 
+import datetime
+import os
 from threading import local
 
-from django.contrib.contenttypes.models import ContentType
-from django.core import serializers
-from django.db import models
+from django.conf import settings
+from django.contrib.contenttypes.generic import GenericRelation
+from django.db import models, router, transaction
+from django.db.models import Q
 from django.db.models.fields import FieldDoesNotExist
-from django.db.models.query import QuerySet
-from django.db.models.signals import post_save, post_delete
-
-from reversion.models import Revision, Version
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.utils import simplejson
+from django.utils.datastructures import SortedDict
+
+from reversion.bulk import MAX_QUERY_PARAMS, bulk_insert, chunked
+from reversion.caches import content_type_cache
+from reversion.deltas import DELTA_FORMATS, make_delta, replay
+from reversion.encodings import decode, encode, get_storage_encoding
+from reversion.models import QueuedRevision, Revision, Version
+from reversion.serialization import ModelSerializer, get_content_hash
+from reversion.spool import Spool, read_records, take_spool
 from reversion.storage import VersionFileStorageWrapper
 
 
@@ -35,14 +45,64 @@ class RegistrationInfo(object):
 
     """Stored registration information about a model."""
 
-    __slots__ = "fields", "file_fields", "follow", "format",
+    __slots__ = "fields", "file_fields", "follow", "format", "serializer", "delta", "keyframe_interval", "delta_threshold", "ignore_duplicates", "follow_plan",
 
-    def __init__(self, fields, file_fields, follow, format):
+    def __init__(self, fields, file_fields, follow, format, serializer=None, delta=False, keyframe_interval=None, delta_threshold=None, ignore_duplicates=False):
         """Initializes the registration info."""
         self.fields = fields
         self.file_fields = file_fields
         self.follow = follow
         self.format = format
+        self.serializer = serializer
+        self.delta = delta
+        self.keyframe_interval = keyframe_interval
+        self.delta_threshold = delta_threshold
+        self.ignore_duplicates = ignore_duplicates
+        # Compiled on first use, as related models may not yet be loaded.
+        self.follow_plan = None
+
+
+class FollowStep(object):
+
+    """
+    A compiled step of a follow plan, following a single relationship.
+
+    Many-to-many relationships are followed through their intermediary
+    table, selecting the related keys from the `through_field` of the rows
+    that match the `through_lookup`.
+    """
+
+    __slots__ = "relationship", "kind", "field", "model", "attname", "lookup", "queryset", "through_queryset", "through_lookup", "through_field",
+
+    def __init__(self, relationship, kind, field, model, attname, lookup, queryset, through_queryset=None, through_lookup=None, through_field=None):
+        """Initializes the follow step."""
+        self.relationship = relationship
+        self.kind = kind
+        self.field = field
+        self.model = model
+        self.attname = attname
+        self.lookup = lookup
+        self.queryset = queryset
+        self.through_queryset = through_queryset
+        self.through_lookup = through_lookup
+        self.through_field = through_field
+
+    def get_related_objects(self, objs):
+        """
+        Returns all the objects related to the given objects, using one query
+        per chunk of objects.
+        """
+        if self.attname is None:
+            values = set([obj.pk for obj in objs])
+        else:
+            values = set([getattr(obj, self.attname) for obj in objs])
+            values.discard(None)
+        related_objs = []
+        for chunk in chunked(values, MAX_QUERY_PARAMS - 1):
+            if self.through_queryset is not None:
+                chunk = self.through_queryset.filter(**{self.through_lookup: chunk}).values(self.through_field)
+            related_objs.extend(self.queryset.filter(**{self.lookup: chunk}))
+        return related_objs
 
 
 class RevisionState(local):
@@ -61,21 +121,35 @@ class RevisionState(local):
         self.depth = 0
         self.is_invalid = False
         self.meta = []
+        self.deletions = {}
 
 
 DEFAULT_SERIALIZATION_FORMAT = "json"
 
+DEFAULT_KEYFRAME_INTERVAL = 10
+
+DEFAULT_DELTA_THRESHOLD = 0.5
+
+# The number of queued revisions saved in each transaction by `flush`.
+DEFAULT_FLUSH_CHUNK_SIZE = 100
+
 
 class RevisionManager(object):
 
     """Manages the configuration and creation of revisions."""
 
-    __slots__ = "__weakref__", "_registry", "_state",
+    __slots__ = "__weakref__", "_registry", "_state", "deferred", "spool",
 
     def __init__(self):
         """Initializes the revision manager."""
         self._registry = {}
         self._state = RevisionState()
+        self.deferred = getattr(settings, "REVERSION_DEFERRED", False)
+        spool_path = getattr(settings, "REVERSION_SPOOL_PATH", None)
+        if spool_path:
+            self.spool = Spool(spool_path, getattr(settings, "REVERSION_SPOOL_SYNC_INTERVAL", 0))
+        else:
+            self.spool = None
 
     # Registration methods.
 
@@ -86,11 +160,25 @@ class RevisionManager(object):
         """
         return model_class in self._registry
 
-    def register(self, model_class, fields=None, follow=(), format=DEFAULT_SERIALIZATION_FORMAT):
-        """Registers a model with this revision manager."""
+    def register(self, model_class, fields=None, follow=(), format=DEFAULT_SERIALIZATION_FORMAT,
+                 delta=False, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL, delta_threshold=DEFAULT_DELTA_THRESHOLD,
+                 ignore_duplicates=False):
+        """
+        Registers a model with this revision manager.
+        
+        If `delta` is True, versions of the model are stored as the fields that
+        changed since the previous version.  A full keyframe is stored instead
+        every `keyframe_interval` versions, or when the delta would be larger than
+        `delta_threshold` times the full serialization.
+        
+        If `ignore_duplicates` is True, no version is saved for objects that are
+        unchanged since their latest version.
+        """
         # Prevent multiple registration.
         if self.is_registered(model_class):
             raise RegistrationError, "%r has already been registered with Reversion." % model_class
+        if delta and not format in DELTA_FORMATS:
+            raise RegistrationError, "%r cannot be stored as deltas using the %r format." % (model_class, format)
         # Ensure the parent model of proxy models is registered.
         if model_class._meta.proxy and not self.is_registered(model_class._meta.parents.keys()[0]):
             raise RegistrationError, "%r is a proxy model, and its parent has not been registered with Reversion." % model_class
@@ -109,7 +197,9 @@ class RevisionManager(object):
         file_fields = tuple(file_fields)
         # Register the generated registration information.
         follow = tuple(follow)
-        registration_info = RegistrationInfo(fields, file_fields, follow, format)
+        serializer = ModelSerializer(model_class, fields, format)
+        registration_info = RegistrationInfo(fields, file_fields, follow, format, serializer,
+                                             delta, max(1, keyframe_interval), delta_threshold, ignore_duplicates)
         self._registry[model_class] = registration_info
         # Connect to the post save signal of the model.
         post_save.connect(self.post_save_receiver, model_class)
@@ -205,57 +295,273 @@ class RevisionManager(object):
         """Checks whether this revision is invalid."""
         return self._state.is_invalid
 
-    def follow_relationships(self, object_set):
+    def get_follow_relation(self, model_class, relationship):
+        """
+        Resolves the named relationship of the given model class.
+
+        Returns a tuple of (kind, field), where kind is one of "fk", "m2m",
+        "generic", "reverse_fk", "reverse_o2o" or "reverse_m2m", and field is
+        the field or related object describing the relationship.
+        """
+        opts = model_class._meta
+        try:
+            field, model, direct, m2m = opts.get_field_by_name(relationship)
+        except FieldDoesNotExist:
+            # Reverse relations are followed by their accessor name.
+            for related in opts.get_all_related_objects() + opts.get_all_related_many_to_many_objects():
+                if related.get_accessor_name() == relationship:
+                    field, direct = related, False
+                    break
+            else:
+                raise TypeError, "Cannot follow the relationship %r. %r has no such relationship." % (relationship, model_class)
+        if direct:
+            if isinstance(field, GenericRelation):
+                return "generic", field
+            if isinstance(field, models.ManyToManyField):
+                return "m2m", field
+            if isinstance(field, models.ForeignKey):
+                return "fk", field
+            raise TypeError, "Cannot follow the relationship %r. Expected a model or QuerySet, found %r." % (relationship, field)
+        if isinstance(field.field, models.ManyToManyField):
+            return "reverse_m2m", field
+        if isinstance(field.field, models.OneToOneField):
+            return "reverse_o2o", field
+        return "reverse_fk", field
+
+    def compile_follow_step(self, model_class, relationship):
+        """
+        Resolves the named relationship of the given model class into a follow
+        step.
+        """
+        kind, field = self.get_follow_relation(model_class, relationship)
+        through_queryset = through_lookup = through_field = None
+        if kind == "fk":
+            model = field.rel.to
+            attname = field.attname
+            lookup = "%s__in" % field.rel.field_name
+            queryset = model._base_manager.all()
+        elif kind in ("m2m", "reverse_m2m"):
+            # The intermediary table is used, as self-referential and hidden
+            # relationships have no usable reverse lookup.
+            if kind == "m2m":
+                model = field.rel.to
+                m2m_field = field
+                through_lookup = "%s__in" % m2m_field.m2m_field_name()
+                through_field = m2m_field.m2m_reverse_field_name()
+            else:
+                model = field.model
+                m2m_field = field.field
+                through_lookup = "%s__in" % m2m_field.m2m_reverse_field_name()
+                through_field = m2m_field.m2m_field_name()
+            attname = None
+            lookup = "pk__in"
+            queryset = model._default_manager.all()
+            through_queryset = m2m_field.rel.through._base_manager.all()
+        elif kind == "generic":
+            model = field.rel.to
+            attname = None
+            lookup = "%s__in" % field.object_id_field_name
+            queryset = model._default_manager.filter(**{"%s__pk" % field.content_type_field_name: content_type_cache.get_for_model(model_class).pk})
+        else:
+            model = field.model
+            related_field = field.field.rel.get_related_field()
+            attname = related_field.attname
+            lookup = "%s__%s__in" % (field.field.name, related_field.name)
+            if kind == "reverse_o2o":
+                queryset = model._base_manager.all()
+            else:
+                queryset = model._default_manager.all()
+        return FollowStep(relationship, kind, field, model, attname, lookup, queryset,
+                          through_queryset, through_lookup, through_field)
+
+    def get_follow_plan(self, model_class):
+        """
+        Returns the follow plan of the given model class, a tuple of follow
+        steps for each of its followed relationships.
+
+        The plan is compiled on first use, and discarded when the model is
+        unregistered.
+        """
+        registration_info = self.get_registration_info(model_class)
+        if registration_info.follow_plan is None:
+            registration_info.follow_plan = tuple([self.compile_follow_step(model_class, relationship)
+                                                   for relationship in registration_info.follow])
+        return registration_info.follow_plan
+
+    def follow_relationships(self, object_set, followed=None):
         """
         Follows all the registered relationships in the given set of models to
         yield a set containing the original models plus all their related
         models.
+
+        The relationship graph is walked breadth-first.  Each level of the walk
+        fetches the related objects of every pending object of the same model
+        with a single query per relationship.
+
+        If a `followed` set is given, every object reached through a
+        relationship is added to it, including objects of the original set.
         """
         result_set = set()
-        def _follow_relationships(obj):
-            # Prevent recursion.
-            if obj in result_set:
-                return
-            result_set.add(obj)
+        pending = list(object_set)
+        while pending:
+            # Group the newly discovered objects by model, preventing recursion.
+            objects_by_model = {}
+            for obj in pending:
+                if obj in result_set:
+                    continue
+                result_set.add(obj)
+                objects_by_model.setdefault(obj.__class__, []).append(obj)
+            pending = []
             # Follow relations.
+            for model_class, objs in objects_by_model.items():
+                for follow_step in self.get_follow_plan(model_class):
+                    related_objs = follow_step.get_related_objects(objs)
+                    if followed is not None:
+                        followed.update(related_objs)
+                    pending.extend(related_objs)
+                # If a proxy model's parent is registered, add it.
+                if model_class._meta.proxy:
+                    parent_cls = model_class._meta.parents.keys()[0]
+                    if self.is_registered(parent_cls):
+                        for chunk in chunked([obj.pk for obj in objs], MAX_QUERY_PARAMS):
+                            pending.extend(parent_cls._default_manager.filter(pk__in=chunk))
+        return result_set
+
+    def get_delta_bases(self, references):
+        """
+        Returns a dictionary mapping the given (content_type, object_id) pairs to
+        the latest version of each object, as a tuple of (keyframe_id, format,
+        chain_length, serialized_data).
+
+        The latest versions, and the delta chains needed to rebuild them, are
+        fetched in batches.
+        """
+        latest_versions = Version.objects.get_latest_values(references, "pk", "keyframe_id", "format", "encoding", "serialized_data")
+        chains = Version.objects.get_delta_chains([latest_version[3] for latest_version in latest_versions
+                                                   if latest_version[3] is not None])
+        delta_bases = {}
+        for content_type, object_id, pk, keyframe_id, format, encoding, serialized_data in latest_versions:
+            if keyframe_id is None:
+                delta_bases[(content_type, object_id)] = (pk, format, 1, decode(serialized_data, encoding))
+            else:
+                chain = [data for version_pk, data in chains[keyframe_id] if version_pk <= pk]
+                delta_bases[(content_type, object_id)] = (keyframe_id, format, len(chain), replay(chain[0], chain[1:]))
+        return delta_bases
+
+    def capture_versions(self, revision_set):
+        """
+        Returns a list of (version, registration_info) pairs, holding an unsaved
+        version of each object in the given set.  The serialized data of the
+        versions is not yet encoded.
+        """
+        versions = []
+        for obj in revision_set:
+            # Proxy models should not actually be saved to the revision set.
+            if obj._meta.proxy:
+                continue
             registration_info = self.get_registration_info(obj.__class__)
-            for relationship in registration_info.follow:
-                # Clear foreign key cache.
-                try:
-                    related_field = obj._meta.get_field(relationship)
-                except models.FieldDoesNotExist:
-                    pass
-                else:
-                    if isinstance(related_field, models.ForeignKey):
-                        if hasattr(obj, related_field.get_cache_name()):
-                            delattr(obj, related_field.get_cache_name())
-                try:
-                    field = obj._meta.get_field_by_name(relationship)[0]
-                except FieldDoesNotExist:
-                    raise TypeError
+            serialized_data = registration_info.serializer.serialize(obj)
+            version = Version(object_id=unicode(obj.pk),
+                              format=registration_info.format,
+                              content_hash=get_content_hash(serialized_data),
+                              serialized_data=serialized_data,
+                              object_repr=unicode(obj),
+                              is_latest=True)
+            version.set_content_type_value(content_type_cache.get_value(obj.__class__))
+            versions.append((version, registration_info))
+        return versions
+
+    def get_followed_references(self, followed):
+        """
+        Returns a set of (content_type_value, object_id) pairs for the given
+        objects.
+        """
+        return set([(content_type_cache.get_value(obj.__class__), unicode(obj.pk))
+                    for obj in followed])
+
+    def get_versions(self, revision_set, followed=None):
+        """Returns an unsaved version of each object in the given set."""
+        return self.prepare_versions(self.capture_versions(revision_set), followed)
+
+    def prepare_versions(self, versions, followed=None):
+        """
+        Prepares the given captured (version, registration_info) pairs to be
+        saved, returning a list of versions, with their serialized data encoded.
+
+        Objects registered with `ignore_duplicates` are skipped if their latest
+        version has the same content hash, unless they were reached through a
+        relationship.  Those objects are given as a set of (content_type_value,
+        object_id) pairs in `followed`, and are always saved, so that reverting
+        the revision keeps them.  If `followed` is None, every object is treated
+        as followed.  No versions are returned if no object has changed.
+        Objects registered with `delta` are stored as a delta against their
+        latest version where possible.
+        """
+        # Skip objects that have not changed since their latest version.
+        references = [(version.content_type, version.object_id)
+                      for version, registration_info in versions if registration_info.ignore_duplicates]
+        if references:
+            latest_hashes = set([(content_type, object_id, content_hash)
+                                 for content_type, object_id, content_hash, is_deleted
+                                 in Version.objects.get_latest_values(references, "content_hash", "is_deleted")
+                                 if not is_deleted])
+            unchanged_versions = set([id(version) for version, registration_info in versions
+                                      if registration_info.ignore_duplicates and
+                                      (version.content_type, version.object_id, version.content_hash) in latest_hashes])
+            if len(unchanged_versions) == len(versions):
+                return []
+            if followed is not None:
+                versions = [(version, registration_info) for version, registration_info in versions
+                            if not id(version) in unchanged_versions or
+                            (version.get_content_type_value(), version.object_id) in followed]
+        # Replace full serializations with deltas where worthwhile.
+        delta_versions = [(version, registration_info) for version, registration_info in versions if registration_info.delta]
+        if delta_versions:
+            delta_bases = self.get_delta_bases([(version.content_type, version.object_id)
+                                                for version, registration_info in delta_versions])
+            for version, registration_info in delta_versions:
                 try:
-                    if hasattr(field, 'rel'):
-                        related_field_model = field.rel.to
-                    elif hasattr(field, 'model'):
-                        related_field_model = field.model
-                    related = getattr(obj, relationship, None)
-                except related_field_model.DoesNotExist:
+                    keyframe_id, format, chain_length, previous_data = delta_bases[(version.content_type, version.object_id)]
+                except KeyError:
                     continue
-                if isinstance(related, models.Model):
-                    _follow_relationships(related)
-                elif isinstance(related, (models.Manager, QuerySet)):
-                    for related_obj in related.all():
-                        _follow_relationships(related_obj)
-                elif related is not None:
-                    raise TypeError, "Cannot follow the relationship %r. Expected a model or QuerySet, found %r." % (relationship, related)
-            # If a proxy model's parent is registered, add it.
-            if obj._meta.proxy:
-                parent_cls = obj._meta.parents.keys()[0]
-                if self.is_registered(parent_cls):
-                    parent_obj = parent_cls.objects.get(pk=obj.pk)
-                    _follow_relationships(parent_obj)
-        map(_follow_relationships, object_set)
-        return result_set
+                if format != version.format or chain_length >= registration_info.keyframe_interval:
+                    continue
+                delta = make_delta(previous_data, version.serialized_data)
+                if len(delta) > len(version.serialized_data) * registration_info.delta_threshold:
+                    continue
+                version.keyframe_id = keyframe_id
+                version.serialized_data = delta
+        versions = [version for version, registration_info in versions]
+        for version in versions:
+            version.encoding = get_storage_encoding(version.serialized_data)
+            version.serialized_data = encode(version.serialized_data, version.encoding)
+        return versions
+
+    def mark_deleted(self, deletions):
+        """
+        Marks the latest versions of the given (content_type_value, object_id)
+        pairs of deleted objects as deletions.
+        """
+        Version.objects.mark_deleted([(content_type_cache.get_content_type(content_type_value), object_id)
+                                      for content_type_value, object_id in deletions])
+
+    def save_versions(self, revision, versions):
+        """
+        Saves the given versions as part of the given revision.
+
+        The previous latest versions of the objects are demoted, and any
+        deletion markers on them are cleared, with a single update per chunk
+        of objects.  All versions are then written using bulk inserts.
+        """
+        for version in versions:
+            version.revision = revision
+        # Demote the previous versions and unset deletions.
+        references = [(version.content_type, version.object_id) for version in versions]
+        for chunk in chunked(references, MAX_QUERY_PARAMS // 2):
+            previous_versions = Version.objects.get_for_object_references(chunk)
+            previous_versions = previous_versions.filter(Q(is_latest=True) | Q(is_deleted=True))
+            previous_versions.update(is_latest=False, is_deleted=False)
+        bulk_insert(Version, versions)
 
     def end(self):
         """Ends a revision."""
@@ -265,41 +571,276 @@ class RevisionManager(object):
         if self._state.depth == 0:
             models = self._state.objects
             try:
+                deletions = [(content_type_value, object_id)
+                             for content_type_value, object_ids in self._state.deletions.items()
+                             for object_id in object_ids]
+                revision_set = None
+                followed = set()
                 if models and not self.is_invalid():
-                    # Save a new revision.
-                    revision = Revision.objects.create(user=self._state.user,
-                                                       comment=self._state.comment)
                     # Follow relationships.
-                    revision_set = self.follow_relationships(self._state.objects)
+                    revision_set = self.follow_relationships(self._state.objects, followed)
                     # Because we might have uncomitted data in models, we need to
                     # replace the models in revision_set which might have come from the
                     # db, with the actual models sent to reversion.
                     diff = revision_set.difference(models)
                     revision_set = models.union(diff)
-                    # Save version models.
-                    for obj in revision_set:
-                        # Proxy models should not actually be saved to the revision set.
-                        if obj._meta.proxy:
-                            continue
-                        registration_info = self.get_registration_info(obj.__class__)
-                        object_id = unicode(obj.pk)
-                        content_type = ContentType.objects.get_for_model(obj)
-                        serialized_data = serializers.serialize(registration_info.format, [obj], fields=registration_info.fields)
-                        Version.objects.create(revision=revision,
-                                               object_id=object_id,
-                                               content_type=content_type,
-                                               format=registration_info.format,
-                                               serialized_data=serialized_data,
-                                               object_repr=unicode(obj))
-
-                        # unset deletions...
-                        Version.objects.filter(object_id=object_id, content_type=content_type, is_deleted=True).update(is_deleted=False)
-
-                    for cls, kwargs in self._state.meta:
-                        cls._default_manager.create(revision=revision, **kwargs)
+                if (self.deferred or self.spool is not None) and not self._state.meta:
+                    # Leave the deletions and versions to be saved later.
+                    versions = []
+                    if revision_set:
+                        versions = self.capture_versions(revision_set)
+                    if versions or deletions:
+                        self.queue_revision(versions, deletions, followed)
+                else:
+                    # The objects were deleted before the versions are saved.
+                    self.mark_deleted(deletions)
+                    if revision_set:
+                        # A revision is only saved if some objects have changed.
+                        versions = self.get_versions(revision_set, self.get_followed_references(followed))
+                        if versions:
+                            # Save a new revision.
+                            revision = Revision.objects.create(user=self._state.user,
+                                                               comment=self._state.comment)
+                            # Save version models.
+                            self.save_versions(revision, versions)
+                            for cls, kwargs in self._state.meta:
+                                cls._default_manager.create(revision=revision, **kwargs)
             finally:
                 self._state.clear()
 
+    # Deferred revision methods.
+
+    def queue_revision(self, versions=(), deletions=(), followed=()):
+        """
+        Queues the given captured (version, registration_info) pairs, and the
+        given (content_type_value, object_id) pairs of deleted objects, to be saved
+        later.  The given objects reached through a relationship are always
+        saved.
+
+        If a spool is configured, the revision is appended to the spool, to be
+        saved by `load_spool`.  Otherwise it is saved to the queue table, to be
+        saved by `flush`.
+        """
+        payload = {"versions": [(version.get_content_type_value(), version.object_id, version.format,
+                                 version.serialized_data, version.object_repr)
+                                for version, registration_info in versions],
+                   "deletions": list(deletions),
+                   "followed": list(self.get_followed_references(followed))}
+        date_created = datetime.datetime.now()
+        if self.spool is None:
+            QueuedRevision.objects.create(user=self._state.user,
+                                          comment=self._state.comment,
+                                          date_created=date_created,
+                                          payload=simplejson.dumps(payload))
+        else:
+            user_attname = Revision._meta.get_field("user").attname
+            payload["user"] = getattr(Revision(user=self._state.user), user_attname)
+            payload["comment"] = self._state.comment
+            payload["date_created"] = date_created.timetuple()[:6] + (date_created.microsecond,)
+            self.spool.append(payload)
+
+    def save_captured_revision(self, user, comment, date_created, payload):
+        """
+        Saves a captured revision.  The user is given as the raw value of the
+        user field of a revision.
+        """
+        versions = []
+        for content_type_value, object_id, format, serialized_data, object_repr in payload["versions"]:
+            registration_info = self._registry.get(content_type_cache.get_model(content_type_value))
+            if registration_info is None or registration_info.format != format:
+                # The registration has changed since the revision was captured.
+                registration_info = RegistrationInfo((), (), (), format)
+            version = Version(object_id=object_id,
+                              format=format,
+                              content_hash=get_content_hash(serialized_data),
+                              serialized_data=serialized_data,
+                              object_repr=object_repr,
+                              is_latest=True)
+            version.set_content_type_value(content_type_value)
+            versions.append((version, registration_info))
+        # The objects were deleted before the versions were captured.
+        self.mark_deleted(payload["deletions"])
+        # Revisions queued before followed objects were recorded save every object.
+        followed = payload.get("followed")
+        if followed is not None:
+            followed = set([(content_type_value, object_id) for content_type_value, object_id in followed])
+        versions = self.prepare_versions(versions, followed)
+        if versions:
+            user_attname = Revision._meta.get_field("user").attname
+            revision = Revision.objects.create(comment=comment, **{user_attname: user})
+            # Keep the date that the revision was captured.
+            Revision.objects.filter(pk=revision.pk).update(date_created=date_created)
+            revision.date_created = date_created
+            self.save_versions(revision, versions)
+
+    def save_queued_revision(self, queued_revision):
+        """Saves the given queued revision."""
+        user_attname = QueuedRevision._meta.get_field("user").attname
+        self.save_captured_revision(getattr(queued_revision, user_attname),
+                                    queued_revision.comment,
+                                    queued_revision.date_created,
+                                    simplejson.loads(queued_revision.payload))
+
+    def flush(self, chunk_size=DEFAULT_FLUSH_CHUNK_SIZE):
+        """
+        Saves the revisions queued in deferred mode, oldest first, and returns
+        the number of queued revisions saved.
+
+        Each chunk of queued revisions is saved and removed from the queue in a
+        single transaction, so every queued revision is saved at least once,
+        even if flushing is interrupted.
+        """
+        using = router.db_for_write(QueuedRevision)
+        def save_chunk(queued_revisions):
+            for queued_revision in queued_revisions:
+                self.save_queued_revision(queued_revision)
+            QueuedRevision.objects.filter(pk__in=[queued_revision.pk for queued_revision in queued_revisions]).delete()
+        # Avoid committing a transaction that is managed by the caller.
+        if not transaction.is_managed(using=using):
+            save_chunk = transaction.commit_on_success(using=using)(save_chunk)
+        count = 0
+        while True:
+            queued_revisions = list(QueuedRevision.objects.order_by("pk")[:chunk_size])
+            if not queued_revisions:
+                break
+            save_chunk(queued_revisions)
+            count += len(queued_revisions)
+        return count
+
+    def load_spool(self, chunk_size=DEFAULT_FLUSH_CHUNK_SIZE):
+        """
+        Saves the revisions appended to the spool, oldest first, and returns
+        the number of records saved.
+
+        The spool is moved aside while it is loaded, so capture continues into
+        a new spool.  Each chunk of records is saved in a single transaction,
+        and the spool is only removed once it is completely loaded, so every
+        record is saved at least once.
+        """
+        if self.spool is None:
+            raise RevisionManagementError, "No spool has been configured with REVERSION_SPOOL_PATH."
+        # Records still buffered by this process are synced before loading.
+        self.spool.sync()
+        loading_path = take_spool(self.spool.path)
+        if loading_path is None:
+            return 0
+        using = router.db_for_write(Revision)
+        def save_chunk(records):
+            for record in records:
+                self.save_captured_revision(record["user"],
+                                            record["comment"],
+                                            datetime.datetime(*record["date_created"]),
+                                            record)
+        # Avoid committing a transaction that is managed by the caller.
+        if not transaction.is_managed(using=using):
+            save_chunk = transaction.commit_on_success(using=using)(save_chunk)
+        count = 0
+        records = []
+        for record in read_records(loading_path):
+            records.append(record)
+            if len(records) >= chunk_size:
+                save_chunk(records)
+                count += len(records)
+                records = []
+        if records:
+            save_chunk(records)
+            count += len(records)
+        os.remove(loading_path)
+        return count
+
+    def revert_objects(self, model_class, object_versions):
+        """
+        Saves the given deserialized objects of the given model class.
+
+        Objects that still exist are updated, and missing objects are written
+        with bulk inserts.  Many-to-many relations are replaced with one delete
+        and one bulk insert per chunk of objects.
+        """
+        using = router.db_for_write(model_class)
+        objs = [object_version.object for object_version in object_versions]
+        existing_pks = set()
+        for chunk in chunked([obj.pk for obj in objs], MAX_QUERY_PARAMS):
+            existing_pks.update(model_class._base_manager.using(using).filter(pk__in=chunk).values_list("pk", flat=True))
+        # Models with no fields besides the primary key have no row to update.
+        force_update = bool([field for field in model_class._meta.local_fields if not field.primary_key])
+        new_objs = []
+        for obj in objs:
+            if obj.pk in existing_pks:
+                models.Model.save_base(obj, using=using, raw=True, force_update=force_update)
+            else:
+                new_objs.append(obj)
+        # Insert the missing objects, sending the same signals as a raw save.
+        for obj in new_objs:
+            pre_save.send(sender=model_class, instance=obj, raw=True)
+        bulk_insert(model_class, new_objs, using=using, raw=True)
+        for obj in new_objs:
+            obj._state.db = using
+            obj._state.adding = False
+            post_save.send(sender=model_class, instance=obj, created=True, raw=True)
+        # Replace the many-to-many relations.
+        for field in model_class._meta.many_to_many:
+            m2m_data = [(object_version.object.pk, object_version.m2m_data[field.name])
+                        for object_version in object_versions if field.name in object_version.m2m_data]
+            if not m2m_data:
+                continue
+            through = field.rel.through
+            source_field_name = field.m2m_field_name()
+            target_field_name = field.m2m_reverse_field_name()
+            source_attname = through._meta.get_field(source_field_name).attname
+            target_attname = through._meta.get_field(target_field_name).attname
+            pairs = set([(pk, related_pk) for pk, related_pks in m2m_data for related_pk in related_pks])
+            # Symmetrical relations are stored in both directions.
+            symmetrical = field.rel.symmetrical and field.rel.to == model_class
+            if symmetrical:
+                pairs.update([(related_pk, pk) for pk, related_pk in pairs])
+            for chunk in chunked([pk for pk, related_pks in m2m_data], MAX_QUERY_PARAMS):
+                through._base_manager.using(using).filter(**{"%s__in" % source_field_name: chunk}).delete()
+                if symmetrical:
+                    through._base_manager.using(using).filter(**{"%s__in" % target_field_name: chunk}).delete()
+            bulk_insert(through, [through(**{source_attname: pk, target_attname: related_pk})
+                                  for pk, related_pk in pairs], using=using)
+
+    def revert_versions(self, versions, delete=False):
+        """
+        Reverts all the objects in the given versions.
+
+        The versions are deserialized together and saved in batches per model.
+        If `delete` is True, objects that are related to the reverted objects,
+        but are not part of the versions, are deleted with one query per chunk
+        of objects of each model.  All changes are made in a single transaction
+        per database.
+        """
+        versions = list(versions)
+        Version.objects.prefetch_serialized_data(versions)
+        object_versions = SortedDict()
+        for version in versions:
+            object_version = version.object_version
+            object_versions.setdefault(object_version.object.__class__, []).append(object_version)
+        def revert():
+            for model_class, model_object_versions in object_versions.items():
+                self.revert_objects(model_class, model_object_versions)
+            if delete:
+                # Delete objects that are no longer in the reverted revision.  The
+                # saved objects are fetched again, as the deserialized objects of
+                # inherited models lack the fields of their parents.
+                old_revision_set = set()
+                for model_class, model_object_versions in object_versions.items():
+                    pks = [object_version.object.pk for object_version in model_object_versions]
+                    for chunk in chunked(pks, MAX_QUERY_PARAMS):
+                        old_revision_set.update(model_class._base_manager.using(router.db_for_write(model_class)).filter(pk__in=chunk))
+                deleted_objects = SortedDict()
+                for obj in self.follow_relationships(old_revision_set):
+                    if not obj in old_revision_set:
+                        deleted_objects.setdefault(obj.__class__, []).append(obj.pk)
+                for model_class, pks in deleted_objects.items():
+                    for chunk in chunked(pks, MAX_QUERY_PARAMS):
+                        model_class._base_manager.using(router.db_for_write(model_class)).filter(pk__in=chunk).delete()
+        # Avoid committing a transaction that is managed by the caller.
+        for using in set([router.db_for_write(model_class) for model_class in object_versions]):
+            if not transaction.is_managed(using=using):
+                revert = transaction.commit_on_success(using=using)(revert)
+        revert()
+
     # Signal receivers.
 
     def post_save_receiver(self, instance, sender, **kwargs):
@@ -308,15 +849,21 @@ class RevisionManager(object):
             self.add(instance)
 
     def post_delete_receiver(self, instance, sender, **kwargs):
-        """Marks the latest version of an object as a deletion."""
-        content_type = ContentType.objects.get_for_model(sender)
-        object_id = instance.pk
-        try:
-            latest_version = Version.objects.filter(content_type=content_type, object_id=object_id).order_by('-revision__date_created')[0]
-            latest_version.is_deleted = True
-            latest_version.save()
-        except (sender.DoesNotExist, IndexError):
-            pass
+        """
+        Marks the latest version of an object as a deletion.
+
+        Objects deleted during a revision are marked at the end of the revision,
+        with one update per chunk of objects of each model.
+        """
+        content_type_value = content_type_cache.get_value(sender)
+        object_id = unicode(instance.pk)
+        if self.is_active():
+            self._state.deletions.setdefault(content_type_value, set()).add(object_id)
+        elif self.deferred or self.spool is not None:
+            # Queued, so that the deletion is saved after any queued versions.
+            self.queue_revision(deletions=[(content_type_value, object_id)])
+        else:
+            self.mark_deleted([(content_type_value, object_id)])
 
     # High-level revision management methods.
 
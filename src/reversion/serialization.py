@@ -0,0 +1,168 @@
+"""Compiled serializers for version controlled models."""
+
+
+import hashlib
+
+from django.core import serializers
+from django.core.serializers.base import DeserializedObject
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import simplejson
+from django.utils.encoding import smart_str, smart_unicode, is_protected_type
+
+from reversion.fields import NaturalKey
+
+
+serializers.register_serializer("fastjson", "reversion.fastjson")
+
+
+# Serialization formats that can be written by a compiled serializer.  The
+# fastjson format writes the same documents as the json format.
+COMPILED_FORMATS = ("json", "fastjson")
+
+
+def get_content_hash(serialized_data):
+    """Returns the hash used to compare the given serialized data."""
+    return hashlib.sha1(smart_str(serialized_data)).hexdigest()
+
+
+def _field_accessor(field):
+    """Returns an accessor for a non-relational field."""
+    attname = field.attname
+    value_to_string = field.value_to_string
+    def accessor(obj):
+        value = getattr(obj, attname)
+        # Protected types are passed through as is, exactly as the stock python
+        # serializer does.
+        if is_protected_type(value):
+            return value
+        return value_to_string(obj)
+    return accessor
+
+
+def _foreign_key_accessor(field):
+    """
+    Returns an accessor for a foreign key field.
+
+    The stored key value is used directly, so the related object is never
+    fetched from the database.
+    """
+    attname = field.attname
+    related_field = field.rel.get_related_field()
+    to_python = related_field.to_python
+    if related_field.primary_key:
+        def accessor(obj):
+            value = getattr(obj, attname)
+            if value is None:
+                return None
+            return to_python(value)
+    else:
+        def accessor(obj):
+            value = getattr(obj, attname)
+            if value is None:
+                return None
+            return smart_unicode(to_python(value), strings_only=True)
+    return accessor
+
+
+def _natural_key_accessor(field):
+    """Returns an accessor for a natural key field, which must be resolved."""
+    name = field.name
+    def accessor(obj):
+        related = getattr(obj, name)
+        if related is None:
+            return None
+        return related._get_pk_val()
+    return accessor
+
+
+def _many_to_many_accessor(field):
+    """Returns an accessor for a many-to-many field, fetching only primary keys."""
+    name = field.name
+    def accessor(obj):
+        return [smart_unicode(pk, strings_only=True)
+                for pk in getattr(obj, name).values_list("pk", flat=True)]
+    return accessor
+
+
+class ModelSerializer(object):
+
+    """
+    A serializer compiled for a single registered model.
+
+    The list of field accessors is resolved once, on first use.  For the json
+    formats this writes exactly the same document as the stock Django
+    serializer, without creating a serializer instance, output buffer and
+    per-field dispatch for every object.  Other formats are delegated to the
+    stock serializers.
+    """
+
+    __slots__ = "model_class", "fields", "format", "_model_label", "_accessors",
+
+    def __init__(self, model_class, fields, format):
+        """Initializes the ModelSerializer."""
+        self.model_class = model_class
+        self.fields = fields
+        self.format = format
+        self._model_label = None
+        self._accessors = None
+
+    def compile(self):
+        """
+        Resolves the field accessors for the model.
+
+        This mirrors the field selection of the stock serializer.  It is
+        deferred until first use so that lazy relations have been resolved.
+        """
+        opts = self.model_class._meta
+        selected_fields = self.fields
+        accessors = []
+        for field in opts.local_fields:
+            if field.serialize:
+                if field.rel is None:
+                    if selected_fields is None or field.attname in selected_fields:
+                        accessors.append((field.name, _field_accessor(field)))
+                else:
+                    if selected_fields is None or field.attname[:-3] in selected_fields:
+                        if isinstance(field, NaturalKey):
+                            accessors.append((field.name, _natural_key_accessor(field)))
+                        else:
+                            accessors.append((field.name, _foreign_key_accessor(field)))
+        for field in opts.many_to_many:
+            if field.serialize:
+                if selected_fields is None or field.attname in selected_fields:
+                    if field.rel.through._meta.auto_created:
+                        accessors.append((field.name, _many_to_many_accessor(field)))
+        self._model_label = smart_unicode(opts)
+        self._accessors = tuple(accessors)
+
+    def serialize(self, obj):
+        """Serializes the given model instance."""
+        if not self.format in COMPILED_FORMATS:
+            return serializers.serialize(self.format, [obj], fields=self.fields)
+        if self._accessors is None:
+            self.compile()
+        current = {}
+        for name, accessor in self._accessors:
+            current[name] = accessor(obj)
+        return simplejson.dumps([{"model": self._model_label,
+                                  "pk": smart_unicode(obj._get_pk_val(), strings_only=True),
+                                  "fields": current}], cls=DjangoJSONEncoder)
+
+
+def freeze_object_version(object_version):
+    """
+    Returns a picklable snapshot of the given deserialized object, from which
+    independent copies can be built without parsing the serialized data again.
+    """
+    obj = object_version.object
+    # The raw field values are read from the instance dictionary, so that
+    # descriptors such as those of file fields are bypassed.
+    values = tuple([(field.attname, obj.__dict__[field.attname]) for field in obj._meta.fields])
+    return obj.__class__, values, object_version.m2m_data
+
+
+def thaw_object_version(frozen_object_version):
+    """Builds a new deserialized object from the given snapshot."""
+    model_class, values, m2m_data = frozen_object_version
+    m2m_data = dict([(name, list(related_pks)) for name, related_pks in m2m_data.items()])
+    return DeserializedObject(model_class(**dict(values)), m2m_data)
@@ -0,0 +1,174 @@
+"""
+An append-only spool file of captured revisions.
+
+Each record is written as a line holding the length of a json document,
+followed by a space and the document itself.  A record that was only partly
+written when a process crashed is detected by its length, and skipped.
+"""
+
+
+import os
+import time
+from threading import Lock
+
+from django.utils import simplejson
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Not available on Windows.
+
+
+def _lock_file(file):
+    """Locks the given file against other processes."""
+    if fcntl is not None:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+
+
+def _unlock_file(file):
+    """Unlocks the given file."""
+    if fcntl is not None:
+        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+
+class Spool(object):
+
+    """
+    A spool file that captured revisions are appended to.
+
+    Appended records are synced to disk at most once every `sync_interval`
+    seconds, so that bursts of appends share a sync.  With a `sync_interval`
+    of zero, every append is synced.
+    """
+
+    def __init__(self, path, sync_interval=0):
+        """Initializes the Spool."""
+        self.path = path
+        self.sync_interval = sync_interval
+        self._lock = Lock()
+        self._file = None
+        self._last_sync = 0
+        self._is_dirty = False
+        self._is_checked = False
+
+    def _is_current(self):
+        """Checks whether the open file is still the spool file."""
+        try:
+            return os.stat(self.path).st_ino == os.fstat(self._file.fileno()).st_ino
+        except OSError:
+            return False
+
+    def append(self, record):
+        """Appends the given record to the spool."""
+        data = simplejson.dumps(record)
+        self._lock.acquire()
+        try:
+            while True:
+                # Reopen the spool if a loader has taken it away.
+                if self._file is not None and not self._is_current():
+                    self._file.close()
+                    self._file = None
+                if self._file is None:
+                    self._file = open(self.path, "ab")
+                    self._is_checked = False
+                file = self._file
+                _lock_file(file)
+                try:
+                    # A loader may have taken the spool while we were waiting.
+                    if not self._is_current():
+                        continue
+                    if not self._is_checked:
+                        self._end_partial_record()
+                        self._is_checked = True
+                    file.write("%d %s\n" % (len(data), data))
+                    file.flush()
+                    self._is_dirty = True
+                    if time.time() - self._last_sync >= self.sync_interval:
+                        self._sync()
+                    break
+                finally:
+                    _unlock_file(file)
+        finally:
+            self._lock.release()
+
+    def _end_partial_record(self):
+        """
+        Ends a record left partly written by a crashed process, so that the
+        next record starts on its own line.
+        """
+        file = open(self.path, "rb")
+        try:
+            file.seek(0, 2)
+            if file.tell() == 0:
+                return
+            file.seek(-1, 2)
+            is_partial = file.read(1) != "\n"
+        finally:
+            file.close()
+        if is_partial:
+            self._file.write("\n")
+
+    def _sync(self):
+        """Syncs the appended records to disk."""
+        if self._file is not None and self._is_dirty:
+            os.fsync(self._file.fileno())
+            self._is_dirty = False
+        self._last_sync = time.time()
+
+    def sync(self):
+        """Syncs any appended records that are not yet on disk."""
+        self._lock.acquire()
+        try:
+            self._sync()
+        finally:
+            self._lock.release()
+
+    def close(self):
+        """Syncs and closes the spool file."""
+        self._lock.acquire()
+        try:
+            self._sync()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        finally:
+            self._lock.release()
+
+
+def take_spool(path):
+    """
+    Moves the spool at the given path aside so that it can be loaded, and
+    returns the path it was moved to, or None if there is nothing to load.
+
+    A spool that was moved aside but not completely loaded is returned again.
+    """
+    loading_path = path + ".loading"
+    if not os.path.exists(loading_path):
+        try:
+            os.rename(path, loading_path)
+        except OSError:
+            return None
+    # Wait for any writer that opened the spool before it was moved.
+    file = open(loading_path, "ab")
+    try:
+        _lock_file(file)
+        _unlock_file(file)
+    finally:
+        file.close()
+    return loading_path
+
+
+def read_records(path):
+    """Iterates over the complete records in the spool at the given path."""
+    file = open(path, "rb")
+    try:
+        for line in file:
+            try:
+                length, data = line.rstrip("\n").split(" ", 1)
+                is_complete = line.endswith("\n") and len(data) == int(length)
+            except ValueError:
+                is_complete = False
+            if is_complete:
+                yield simplejson.loads(data)
+    finally:
+        file.close()
@@ -1,7 +1,13 @@
 from reversion.tests.admin import *
+from reversion.tests.bulk import *
+from reversion.tests.caches import *
+from reversion.tests.deltas import *
+from reversion.tests.encodings import *
 from reversion.tests.helpers import *
 from reversion.tests.managers import *
 from reversion.tests.middleware import *
 from reversion.tests.models import *
 from reversion.tests.revisions import *
+from reversion.tests.serialization import *
+from reversion.tests.spool import *
 from reversion.tests.storage import *
@@ -0,0 +1,50 @@
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from reversion.models import Version
+from reversion.revisions import revision
+from test_project.test_app.models import ChildModel, RelatedModel
+
+class TestOfRevisionForm(TestCase):
+    urls = 'test_project.urls'
+
+    def setUp(self):
+        self.registered = set(revision._registry)
+        # Registers the test models with the admin, and so with reversion.
+        admin.autodiscover()
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+
+    def tearDown(self):
+        # A failed request can leave the revision of the middleware open.
+        while revision.is_active():
+            revision.invalidate()
+            revision.end()
+        for model in set(revision._registry) - self.registered:
+            revision.unregister(model)
+
+    def test_revision_form_shows_the_inline_versions(self):
+        revision.start()
+        try:
+            child = ChildModel.objects.create(parent_name='parent', child_name='child')
+            kept = RelatedModel.objects.create(child_model=child, related_name='kept')
+            removed = RelatedModel.objects.create(child_model=child, related_name='removed')
+        finally:
+            revision.end()
+        version = Version.objects.get_for_object(child)[0]
+        kept.related_name = 'kept-2'
+        kept.save()
+        added = RelatedModel.objects.create(child_model=child, related_name='added')
+        removed.delete()
+        response = self.client.get(reverse('admin:test_app_childmodel_revision', args=(child.pk, version.pk)))
+        self.assertEqual(response.status_code, 200)
+        formset = response.context['inline_admin_formsets'][0].formset
+        self.assertEqual(formset.model, RelatedModel)
+        self.assertEqual(len(formset.forms), 3)
+        # Existing objects show their version, objects added since are deleted,
+        # and objects removed since are added back.
+        self.assertEqual([(initial.get('id'), initial['related_name'], initial.get('DELETE', False))
+                          for initial in formset.initial],
+                         [(kept.pk, 'kept', False), (added.pk, 'added', True), (None, 'removed', False)])
+        self.assertEqual([form.initial.get('DELETE', False) for form in formset.forms], [False, True, False])
@@ -0,0 +1,11 @@
+from django.test import TestCase
+from reversion.bulk import bulk_insert
+from test_project.test_app.models import ParentModel
+
+class TestOfBulkInsert(TestCase):
+    def test_inserts_objects_with_and_without_primary_keys(self):
+        bulk_insert(ParentModel, [ParentModel(parent_name='generated'),
+                                  ParentModel(pk=1000, parent_name='given'),
+                                  ParentModel(parent_name='generated')])
+        self.assertEqual(ParentModel.objects.get(pk=1000).parent_name, 'given')
+        self.assertEqual(ParentModel.objects.filter(parent_name='generated').count(), 2)
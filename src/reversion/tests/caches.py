@@ -0,0 +1,87 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, reset_queries
+from django.test import TestCase
+from reversion.caches import ContentTypeCache, LRUCache, content_type_cache, object_version_cache
+from reversion.models import Version
+from reversion.revisions import revision
+import random
+
+class TestOfLRUCache(TestCase):
+    def test_least_recently_used_items_are_evicted(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual((cache.hits, cache.misses, cache.evictions), (3, 1, 1))
+        cache.clear()
+        self.assertEqual((len(cache), cache.hits, cache.misses, cache.evictions), (0, 0, 0, 0))
+
+    def test_empty_caches_store_nothing(self):
+        cache = LRUCache(0)
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), None)
+
+class TestOfContentTypeCache(TestCase):
+    def test_content_types_are_looked_up_once(self):
+        cache = ContentTypeCache()
+        content_type = ContentType.objects.get_for_model(User)
+        value = cache.get_value(User)
+        settings.DEBUG = True
+        try:
+            reset_queries()
+            self.assertEqual(cache.get_value(User), value)
+            self.assertEqual(cache.get_content_type(value), content_type)
+            self.assertEqual(cache.get_for_model(User), content_type)
+            self.assertEqual(len(connection.queries), 0)
+        finally:
+            settings.DEBUG = False
+        self.assertEqual(ContentTypeCache().get_model(value), User)
+
+    def test_cache_is_cleared_when_content_types_change(self):
+        old_content_type = ContentType.objects.get_for_model(User)
+        content_type_cache.get_value(User)
+        try:
+            old_content_type.delete()
+            content_type = content_type_cache.get_for_model(User)
+            self.assertNotEqual(content_type.pk, old_content_type.pk)
+            self.assertEqual(ContentType.objects.get(pk=content_type.pk), content_type)
+        finally:
+            # The new content type is rolled back with the test.
+            ContentType.objects.clear_cache()
+            content_type_cache.clear()
+
+class TestOfObjectVersionCache(TestCase):
+    def setUp(self):
+        revision.register(User)
+        object_version_cache.size = 10
+        object_version_cache.clear()
+
+    def tearDown(self):
+        revision.unregister(User)
+        object_version_cache.size = 0
+        object_version_cache.clear()
+
+    def test_object_versions_are_shared_between_instances(self):
+        revision.start()
+        try:
+            user = User.objects.create(username='rand%d'%random.randint(1, 100))
+            user.groups.create(name='rand%d'%random.randint(1, 100))
+        finally:
+            revision.end()
+        version = Version.objects.get_for_object(user).get()
+        self.assertTrue(version.object_version is version.object_version)
+        self.assertEqual(object_version_cache.misses, 1)
+        other_version = Version.objects.get(pk=version.pk)
+        object_version = other_version.object_version
+        self.assertEqual(object_version_cache.hits, 1)
+        self.assertFalse(object_version.object is version.object_version.object)
+        for field in User._meta.fields:
+            self.assertEqual(field.value_from_object(object_version.object), field.value_from_object(version.object_version.object))
+        self.assertEqual(object_version.m2m_data, version.object_version.m2m_data)
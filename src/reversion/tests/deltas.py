@@ -0,0 +1,90 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, reset_queries
+from django.test import TestCase
+from reversion.models import Revision, Version
+from reversion.revisions import revision, RegistrationError
+import random
+
+class TestOfDeltas(TestCase):
+    def tearDown(self):
+        try:
+            revision.unregister(User)
+        except RegistrationError:
+            pass
+
+    def save_versions(self, number):
+        user = User.objects.create(username='rand%d'%random.randint(1, 100))
+        for i in range(number):
+            revision.start()
+            try:
+                user.first_name = 'name-%d' % i
+                user.save()
+            finally:
+                revision.end()
+        return user
+
+    def test_deltas_are_replayed_from_keyframes(self):
+        revision.register(User, delta=True, keyframe_interval=3)
+        user = self.save_versions(5)
+        versions = list(Version.objects.get_for_object(user))
+        self.assertEqual([version.keyframe_id for version in versions],
+                         [None, versions[0].pk, versions[0].pk, None, versions[3].pk])
+        for i, version in enumerate(Version.objects.get_for_object(user)):
+            self.assertEqual(version.field_dict['first_name'], 'name-%d' % i)
+            self.assertEqual(version.object_version.object.username, user.username)
+        self.assertEqual(len(Version.objects.get_unique_for_object(user)), 5)
+
+    def test_large_deltas_are_stored_as_keyframes(self):
+        revision.register(User, delta=True, delta_threshold=0)
+        user = self.save_versions(3)
+        self.assertEqual(Version.objects.get_for_object(user).filter(keyframe_id__isnull=False).count(), 0)
+
+    def test_deleting_versions_keeps_the_chain_readable(self):
+        revision.register(User, delta=True)
+        user = self.save_versions(4)
+        versions = list(Version.objects.get_for_object(user))
+        versions[0].delete()
+        versions[2].delete()
+        versions = list(Version.objects.get_for_object(user))
+        self.assertEqual([version.keyframe_id for version in versions],
+                         [None, versions[0].pk])
+        self.assertEqual([version.field_dict['first_name'] for version in versions],
+                         ['name-1', 'name-3'])
+
+    def test_deleting_versions_together_keeps_the_chain_readable(self):
+        revision.register(User, delta=True)
+        user = self.save_versions(5)
+        versions = list(Version.objects.get_for_object(user))
+        Version.objects.filter(pk__in=[versions[0].pk, versions[2].pk, versions[4].pk]).delete()
+        versions = list(Version.objects.get_for_object(user))
+        self.assertEqual([version.keyframe_id for version in versions],
+                         [None, versions[0].pk])
+        self.assertEqual([version.field_dict['first_name'] for version in versions],
+                         ['name-1', 'name-3'])
+
+    def test_deleting_a_revision_without_deltas_uses_one_query_for_chains(self):
+        revision.register(User)
+        users = [User.objects.create(username='user-%d' % i) for i in range(20)]
+        for i in range(2):
+            revision.start()
+            try:
+                for user in users:
+                    user.first_name = 'name-%d' % i
+                    user.save()
+            finally:
+                revision.end()
+        first_revision = Revision.objects.order_by('pk')[0]
+        settings.DEBUG = True
+        try:
+            reset_queries()
+            first_revision.delete()
+            queries = [query['sql'] for query in connection.queries]
+        finally:
+            settings.DEBUG = False
+        chain_lookup = '%s IN' % connection.ops.quote_name('keyframe_id')
+        self.assertEqual(len([sql for sql in queries if chain_lookup in sql]), 1)
+        self.assertEqual(Version.objects.count(), len(users))
+
+    def test_only_json_can_be_stored_as_deltas(self):
+        self.assertRaises(RegistrationError, revision.register, User, format='xml', delta=True)
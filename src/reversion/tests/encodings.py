@@ -0,0 +1,68 @@
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from reversion import encodings
+from reversion.models import Version
+from reversion.revisions import revision
+import random
+
+class TestOfEncodings(TestCase):
+    def setUp(self):
+        revision.register(User)
+
+    def tearDown(self):
+        revision.unregister(User)
+
+    def create_user(self, **kwargs):
+        revision.start()
+        try:
+            return User.objects.create(username='rand%d'%random.randint(1, 100), **kwargs)
+        finally:
+            revision.end()
+
+    def test_encodings_round_trip(self):
+        data = u'[{"model": "auth.user", "fields": {"first_name": "\\u00e9t\\u00e9"}}]' * 10
+        for name in ("", "zlib", encodings.DEFAULT_ENCODING):
+            self.assertEqual(encodings.decode(encodings.encode(data, name), name), data)
+        self.assertTrue(len(encodings.encode(data, "zlib")) < len(data))
+
+    def test_unknown_encodings_are_rejected(self):
+        self.assertRaises(encodings.EncodingError, encodings.decode, u"", "unknown")
+
+    def test_versions_are_saved_plain_by_default(self):
+        user = self.create_user(first_name=u'\xe9t\xe9')
+        version = Version.objects.get_for_object(user)[0]
+        self.assertEqual(version.encoding, '')
+        self.assertEqual(version.serialized_data, version.get_serialized_data())
+
+    def test_versions_over_the_threshold_are_saved_encoded(self):
+        old_encoding, old_threshold = encodings.DEFAULT_ENCODING, encodings.ENCODING_THRESHOLD
+        encodings.DEFAULT_ENCODING = 'zlib'
+        try:
+            encodings.ENCODING_THRESHOLD = 100000
+            small_user = self.create_user()
+            encodings.ENCODING_THRESHOLD = 0
+            user = self.create_user(first_name=u'\xe9t\xe9')
+        finally:
+            encodings.DEFAULT_ENCODING, encodings.ENCODING_THRESHOLD = old_encoding, old_threshold
+        self.assertEqual(Version.objects.get_for_object(small_user)[0].encoding, '')
+        version = Version.objects.get_for_object(user)[0]
+        self.assertEqual(version.encoding, 'zlib')
+        self.assertNotEqual(version.serialized_data, version.get_serialized_data())
+        self.assertEqual(version.get_object_version().object, user)
+
+    def test_recompress_versions(self):
+        user = self.create_user()
+        version = Version.objects.get_for_object(user)[0]
+        call_command('recompressversions', encoding='', chunk_size='1')
+        version = Version.objects.get(pk=version.pk)
+        self.assertEqual(version.encoding, '')
+        self.assertEqual(version.serialized_data, version.get_serialized_data())
+        call_command('recompressversions', encoding='zlib')
+        version = Version.objects.get(pk=version.pk)
+        self.assertEqual(version.encoding, 'zlib')
+        self.assertEqual(version.get_object_version().object, user)
+        call_command('recompressversions')
+        version = Version.objects.get(pk=version.pk)
+        self.assertEqual(version.encoding, encodings.get_storage_encoding(version.get_serialized_data()))
+        self.assertEqual(version.get_object_version().object, user)
@@ -16,7 +16,9 @@ from reversion.models import Version, Revision
 
 
 try:
-    from reversion.helpers import generate_patch, generate_patch_html
+    from reversion import helpers
+    from reversion.helpers import generate_patch, generate_patch_html, generate_patches_html, diff_cache, \
+                                  diff_values, DIFF_CHARS, DIFF_LINES, DIFF_STRUCTURE
 except ImportError:
     pass
 else:
@@ -61,5 +63,116 @@ else:
             revision.unregister(Site)
             self.site.delete()
             Version.objects.all().delete()
+
+
+    class PatchesHtmlTest(unittest.TestCase):
+        
+        """Tests the cached generation of html patches."""
+        
+        def setUp(self):
+            """Sets up a versioned site model to test."""
+            revision.register(Site)
+            diff_cache.clear()
+            with revision:
+                site = Site.objects.create(name="site", domain="www.site-rev-1.com")
+            with revision:
+                site.domain = "www.site-rev-2.com"
+                site.save()
+            self.site = site
+            
+        def getVersions(self):
+            """Returns fresh instances of the two versions of the site."""
+            return list(Version.objects.get_for_object(self.site))
+            
+        def testCanGeneratePatchesHtml(self):
+            """Tests that html patches are generated for several fields."""
+            version_0, version_1 = self.getVersions()
+            patches = generate_patches_html(version_0, version_1, ["name", "domain"])
+            self.assertEqual(patches["domain"], generate_patch_html(version_0, version_1, "domain"))
+            self.assertEqual(patches["name"], helpers.dmp.diff_prettyHtml([(0, u"site")]))
+            
+        def testPatchesAreCached(self):
+            """Tests that cached patches do not deserialize the versions."""
+            version_0, version_1 = self.getVersions()
+            patches = generate_patches_html(version_0, version_1, ["name", "domain"])
+            version_0, version_1 = self.getVersions()
+            self.assertEqual(generate_patches_html(version_0, version_1, ["name", "domain"]), patches)
+            self.assertFalse(hasattr(version_0, "_field_dict_cache"))
+            self.assertFalse(hasattr(version_1, "_field_dict_cache"))
+            
+        def testCacheKeysFollowVersionContent(self):
+            """Tests that rewritten versions are not served stale patches."""
+            version_0, version_1 = self.getVersions()
+            cache_key = helpers.get_diff_cache_key(version_0, version_1, "domain")
+            Version.objects.filter(pk=version_1.pk).update(content_hash="")
+            version_0, version_1 = self.getVersions()
+            self.assertEqual(helpers.get_diff_cache_key(version_0, version_1, "domain"), cache_key)
+            Version.objects.filter(pk=version_1.pk).update(serialized_data=version_0.serialized_data,
+                                                           encoding=version_0.encoding)
+            version_0, version_1 = self.getVersions()
+            self.assertNotEqual(helpers.get_diff_cache_key(version_0, version_1, "domain"), cache_key)
             
+        def testTruncatedPatchesAreNotCached(self):
+            """Tests that patches cut short by their deadline are not cached."""
+            version_0, version_1 = self.getVersions()
+            old_get_deadline = helpers.get_deadline
+            helpers.get_deadline = lambda timeout=None: 0
+            try:
+                generate_patches_html(version_0, version_1, ["domain"])
+            finally:
+                helpers.get_deadline = old_get_deadline
+            self.assertEqual(diff_cache.get(helpers.get_diff_cache_key(version_0, version_1, "domain")), None)
+            generate_patches_html(version_0, version_1, ["domain"])
+            self.assertNotEqual(diff_cache.get(helpers.get_diff_cache_key(version_0, version_1, "domain")), None)
+            
+        def testLargeTextsAreDiffedByLine(self):
+            """Tests that texts over the size limit are diffed line by line."""
+            old_size_limit = helpers.DIFF_SIZE_LIMIT
+            helpers.DIFF_SIZE_LIMIT = 0
+            try:
+                self.assertEqual(diff_values(u"a\nbcde\nf\n", u"a\nxcdy\nf\n"),
+                                 [(0, u"a\n"), (-1, u"bcde"), (1, u"xcdy"), (0, u"\nf\n")])
+            finally:
+                helpers.DIFF_SIZE_LIMIT = old_size_limit
+            
+        def testLineDiffsAreRefinedByCharacter(self):
+            """Tests that changed lines are refined to character differences."""
+            self.assertEqual(diff_values(u"a\nbcde\nf\n", u"a\nxcdy\nf\n", DIFF_LINES),
+                             [(0, u"a\n"), (-1, u"b"), (1, u"x"), (0, u"cd"), (-1, u"e"), (1, u"y"), (0, u"\nf\n")])
+            self.assertEqual(diff_values(u"a\nb\n", u"a\n", DIFF_LINES),
+                             [(0, u"a\n"), (-1, u"b\n")])
+            
+        def testCanDiffStructures(self):
+            """Tests that dict and list values are diffed by key and item."""
+            diffs = diff_values({"a": 1, "b": [1, 2]}, {"b": [1, 3], "a": 1}, DIFF_STRUCTURE)
+            self.assertEqual([(operation, text) for operation, text in diffs if operation],
+                             [(-1, u"2"), (1, u"3")])
+            diffs = diff_values(u'{"a": 1}', u'{"a": 2}', DIFF_STRUCTURE)
+            self.assertEqual(diffs, [(0, u".a: "), (-1, u"1"), (1, u"2"), (0, u"\n")])
+            self.assertEqual(helpers.format_structure({"a": [{"b": None}, 1], "c": {}}),
+                             u".a[0].b: null\n.a[1]: 1\n.c: {}\n")
+            
+        def testListsAreDiffedByCharacterByDefault(self):
+            """Tests that list values, such as many-to-many fields, are diffed as text by default."""
+            self.assertEqual(diff_values([1, 2], [1, 3]),
+                             [(0, u"[1, "), (-1, u"2"), (1, u"3"), (0, u"]")])
             
+        def testDiffsAreCutShortByTimeout(self):
+            """Tests that a diff over its timeout returns a coarse result."""
+            old_text = u"".join([unichr(0x41 + (i * 7) % 26) for i in xrange(2000)])
+            new_text = u"".join([unichr(0x41 + (i * 11) % 26) for i in xrange(2000)])
+            diffs = diff_values(old_text, new_text, DIFF_CHARS, timeout=0.000001)
+            self.assertEqual(u"".join([text for operation, text in diffs if operation <= 0]), old_text)
+            self.assertEqual(u"".join([text for operation, text in diffs if operation >= 0]), new_text)
+            self.assertTrue(len(diffs) < len(diff_values(old_text, new_text, DIFF_CHARS, timeout=0)))
+            
+        def testUnknownModeIsRejected(self):
+            """Tests that an unknown diff mode raises an error."""
+            self.assertRaises(ValueError, diff_values, u"a", u"b", "words")
+        
+        def tearDown(self):
+            """Deletes the versioned site model."""
+            revision.unregister(Site)
+            self.site.delete()
+            Version.objects.all().delete()
+            diff_cache.clear()
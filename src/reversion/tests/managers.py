@@ -1,5 +1,8 @@
+from django.conf import settings
+from django.db import connection, reset_queries
 from django.test import TestCase
-from django.contrib.auth.models import User
+from django.contrib.auth.models import Group, User
+from django.core.management import call_command
 from reversion.revisions import revision
 from reversion.models import Revision, Version 
 import random
@@ -162,3 +165,253 @@ class TestOfManager(TestCase):
         deleted = Version.objects.get_deleted(User)
         self.assertEqual(len(deleted), random_number_of_users)
 
+
+    def test_only_the_most_recent_version_is_marked_latest(self):
+        revision.register(User)
+        user = User.objects.create(
+            username='rand-%d' % random.randint(1, 100),
+        )
+        random_number_of_versions = random.randint(2, 10)
+        for i in range(random_number_of_versions):
+            try:
+                revision.start()
+                user.username = 'sequential-%d' % i
+                user.save()
+            except:
+                revision.invalidate()
+            finally:
+                revision.end()
+        versions = Version.objects.get_for_object(user)
+        self.assertEqual([version.is_latest for version in versions], [False] * (random_number_of_versions - 1) + [True])
+        self.assertEqual(Version.objects.get_for_date(user, datetime.datetime.now()), versions[random_number_of_versions - 1])
+        self.assertEqual(Version.objects.get_for_date(user, versions[0].revision.date_created), versions[0])
+        # Deleting the latest version promotes the previous one.
+        versions[random_number_of_versions - 1].revision.delete()
+        self.assertTrue(Version.objects.get_for_object(user).order_by("-pk")[0].is_latest)
+
+    def test_deleting_a_revision_promotes_the_previous_versions_together(self):
+        revision.register(User)
+        users = [User.objects.create(username='user-%d' % i) for i in range(20)]
+        for i in range(3):
+            revision.start()
+            try:
+                for user in users:
+                    user.first_name = 'name-%d' % i
+                    user.save()
+            finally:
+                revision.end()
+        latest_revision = Revision.objects.order_by('-pk')[0]
+        settings.DEBUG = True
+        try:
+            reset_queries()
+            latest_revision.delete()
+            queries = len(connection.queries)
+        finally:
+            settings.DEBUG = False
+        # Collecting and deleting the versions and the revision, finding and
+        # promoting the previous versions, and fetching the delta chains.
+        self.assertEqual(queries, 6)
+        latest_versions = Version.objects.filter(is_latest=True)
+        self.assertEqual(latest_versions.count(), len(users))
+        self.assertEqual(set([version.revision_id for version in latest_versions]),
+                         set([Revision.objects.order_by('-pk')[0].pk]))
+
+    def test_deletion_marks_only_the_latest_version(self):
+        revision.register(User)
+        user = User.objects.create(
+            username='rand-%d' % random.randint(1, 100),
+        )
+        pk = user.pk
+        for i in range(2):
+            try:
+                revision.start()
+                user.save()
+            except:
+                revision.invalidate()
+            finally:
+                revision.end()
+        user.delete()
+        self.assertEqual([version.is_deleted for version in Version.objects.get_for_object_reference(User, pk)], [False, True])
+
+    def save_user(self, user, username):
+        try:
+            revision.start()
+            user.username = username
+            user.save()
+        except:
+            revision.invalidate()
+        finally:
+            revision.end()
+        return Revision.objects.order_by("-pk")[0]
+
+    def test_hash_based_history_queries(self):
+        revision.register(User)
+        user = User.objects.create(username='rand-%d' % random.randint(1, 100))
+        first_revision = self.save_user(user, 'first')
+        second_revision = self.save_user(user, 'second')
+        third_revision = self.save_user(user, 'first')
+        versions = list(Version.objects.get_for_object(user))
+        self.assertEqual(list(Version.objects.get_equal_for_version(versions[0])), [versions[0], versions[2]])
+        self.assertTrue(Version.objects.has_changed_between(first_revision, second_revision))
+        self.assertFalse(Version.objects.has_changed_between(first_revision, third_revision))
+        self.assertEqual(len(Version.objects.get_unique_for_object(user)), 3)
+
+    def test_has_changed_between_compares_revisions(self):
+        revision.register(User)
+        user = User.objects.create(username='rand-%d' % random.randint(1, 100))
+        first_revision = self.save_user(user, 'first')
+        second_revision = self.save_user(user, 'second')
+        third_revision = self.save_user(user, 'first')
+        self.assertFalse(Version.objects.has_changed_between(first_revision, first_revision))
+        # Versions without a content hash are compared by their data.
+        Version.objects.filter(revision=first_revision).update(content_hash="")
+        self.assertFalse(Version.objects.has_changed_between(first_revision, third_revision))
+        Version.objects.filter(revision=second_revision).update(content_hash="")
+        self.assertTrue(Version.objects.has_changed_between(first_revision, second_revision))
+        # An object missing from one of the revisions was added or removed.
+        other_user = User.objects.create(username='other-%d' % random.randint(1, 100))
+        fourth_revision = self.save_user(other_user, 'other')
+        self.assertTrue(Version.objects.has_changed_between(third_revision, fourth_revision))
+
+    def test_has_changed_between_compares_hashes_in_the_database(self):
+        revision.register(User)
+        users = [User.objects.create(username='user-%d' % i) for i in range(5)]
+        revisions = []
+        for i in range(3):
+            revision.start()
+            try:
+                for user in users:
+                    user.first_name = i == 1 and 'changed' or 'name'
+                    user.save()
+            finally:
+                revision.end()
+            revisions.append(Revision.objects.order_by('-pk')[0])
+        settings.DEBUG = True
+        try:
+            reset_queries()
+            self.assertFalse(Version.objects.has_changed_between(revisions[0], revisions[2]))
+            queries = len(connection.queries)
+        finally:
+            settings.DEBUG = False
+        # Finding the unmatched hashes, and the versions without a hash.
+        self.assertEqual(queries, 2)
+        self.assertTrue(Version.objects.has_changed_between(revisions[0], revisions[1]))
+
+    def test_has_changed_between_compares_objects_skipped_as_duplicates(self):
+        revision.register(Group, ignore_duplicates=True)
+        try:
+            revision.start()
+            try:
+                first_group = Group.objects.create(name='first')
+                second_group = Group.objects.create(name='second')
+            finally:
+                revision.end()
+            first_revision = Revision.objects.order_by("-pk")[0]
+            revision.start()
+            try:
+                first_group.name = 'changed'
+                first_group.save()
+                second_group.save()
+            finally:
+                revision.end()
+            second_revision = Revision.objects.order_by("-pk")[0]
+            revision.start()
+            try:
+                first_group.name = 'first'
+                first_group.save()
+            finally:
+                revision.end()
+            third_revision = Revision.objects.order_by("-pk")[0]
+            self.assertEqual(Version.objects.filter(revision=third_revision).count(), 1)
+            # The skipped group is compared with its latest version as of each revision.
+            self.assertFalse(Version.objects.has_changed_between(first_revision, third_revision))
+            self.assertTrue(Version.objects.has_changed_between(second_revision, third_revision))
+            revision.start()
+            try:
+                third_group = Group.objects.create(name='third')
+            finally:
+                revision.end()
+            fourth_revision = Revision.objects.order_by("-pk")[0]
+            self.assertTrue(Version.objects.has_changed_between(third_revision, fourth_revision))
+        finally:
+            revision.unregister(Group)
+
+    def test_content_hashes_can_be_backfilled(self):
+        revision.register(User)
+        user = User.objects.create(username='rand-%d' % random.randint(1, 100))
+        for username in ('first', 'first', 'second'):
+            self.save_user(user, username)
+        content_hashes = list(Version.objects.get_for_object(user).values_list("content_hash", flat=True))
+        Version.objects.update(content_hash="")
+        self.assertEqual(len(Version.objects.get_unique_for_object(user)), 2)
+        call_command('hashversions', chunk_size='2')
+        self.assertEqual(list(Version.objects.get_for_object(user).values_list("content_hash", flat=True)), content_hashes)
+
+    def test_iter_for_object_streams_versions_in_chunks(self):
+        revision.register(User)
+        user = User.objects.create(username='rand-%d' % random.randint(1, 100))
+        for i in range(random.randint(5, 20)):
+            self.save_user(user, 'name-%d' % i)
+        versions = list(Version.objects.iter_for_object(user, chunk_size=3))
+        self.assertEqual([version.pk for version in versions],
+                         list(Version.objects.get_for_object(user).values_list("pk", flat=True)))
+        self.assertFalse("serialized_data" in versions[0].__dict__)
+        self.assertEqual([version.object_version.object.username for version in versions],
+                         ['name-%d' % i for i in range(len(versions))])
+        self.assertEqual(len(list(Version.objects.iter_for_model(User, chunk_size=4))), len(versions))
+
+    def test_get_all_for_date_returns_the_state_of_every_object(self):
+        revision.register(User)
+        users = [User.objects.create(username='rand-%d-%d' % (i, random.randint(1, 100))) for i in range(3)]
+        for user in users:
+            self.save_user(user, '%s-before' % user.pk)
+        Revision.objects.update(date_created=datetime.datetime(2010, 1, 1))
+        for user in users[:2]:
+            self.save_user(user, '%s-after' % user.pk)
+        date = datetime.datetime(2010, 1, 2)
+        versions = list(Version.objects.get_all_for_date(User, date))
+        self.assertEqual([version.object_version.object.username for version in versions],
+                         ['%s-before' % user.pk for user in users])
+        versions = list(Version.objects.get_all_for_date(User.objects.filter(pk__in=[user.pk for user in users[1:]]), date))
+        self.assertEqual([version.object_id for version in versions], [unicode(user.pk) for user in users[1:]])
+        versions = list(Version.objects.get_all_for_date(User, datetime.datetime.now()))
+        self.assertEqual(sorted([version.field_dict['username'] for version in versions]),
+                         sorted(['%s-after' % users[0].pk, '%s-after' % users[1].pk, '%s-before' % users[2].pk]))
+
+    def test_get_page_for_object_reference_pages_with_a_keyset(self):
+        revision.register(User)
+        user = User.objects.create(username='rand-%d' % random.randint(1, 100))
+        for i in range(5):
+            self.save_user(user, 'name-%d' % i)
+        # Revisions saved at the same time are ordered by version.
+        Revision.objects.update(date_created=datetime.datetime(2010, 1, 1))
+        pks = list(Version.objects.get_for_object(user).order_by("-pk").values_list("pk", flat=True))
+        versions, has_more = Version.objects.get_page_for_object_reference(User, user.pk, page_size=2)
+        self.assertEqual([version.pk for version in versions], pks[:2])
+        self.assertTrue(has_more)
+        self.assertFalse("serialized_data" in versions[0].__dict__)
+        versions, has_more = Version.objects.get_page_for_object_reference(User, user.pk, after=versions[-1].pk, page_size=2)
+        self.assertEqual([version.pk for version in versions], pks[2:4])
+        self.assertTrue(has_more)
+        versions, has_more = Version.objects.get_page_for_object_reference(User, user.pk, after=versions[-1].pk, page_size=2)
+        self.assertEqual([version.pk for version in versions], pks[4:])
+        self.assertFalse(has_more)
+        self.assertEqual(versions[0].revision.date_created, datetime.datetime(2010, 1, 1))
+
+    def test_get_deleted_page_pages_and_searches_deleted_versions(self):
+        revision.register(User)
+        users = [User.objects.create(username='rand-%d-%d' % (i, random.randint(1, 100))) for i in range(5)]
+        for user in users:
+            self.save_user(user, 'name-%d' % user.pk)
+        User.objects.filter(pk__in=[user.pk for user in users]).delete()
+        pks = list(Version.objects.get_deleted(User).values_list("pk", flat=True))
+        self.assertEqual(pks, sorted(pks, reverse=True))
+        versions, has_more = Version.objects.get_deleted_page(User, page_size=3)
+        self.assertEqual([version.pk for version in versions], pks[:3])
+        self.assertTrue(has_more)
+        self.assertFalse("serialized_data" in versions[0].__dict__)
+        versions, has_more = Version.objects.get_deleted_page(User, after=versions[-1].pk, page_size=3)
+        self.assertEqual([version.pk for version in versions], pks[3:])
+        self.assertFalse(has_more)
+        versions, has_more = Version.objects.get_deleted_page(User, search='name-%d' % users[2].pk)
+        self.assertEqual([version.object_id for version in versions], [unicode(users[2].pk)])
@@ -0,0 +1,46 @@
+from django.conf import settings
+from django.db import connection, reset_queries
+from django.test import TestCase
+from reversion.models import Version
+from reversion.revisions import revision
+from test_project.test_app.models import ChildModel, ParentModel
+import random
+
+class TestOfVersionFieldDict(TestCase):
+    def setUp(self):
+        self.registered = not revision.is_registered(ChildModel)
+        if self.registered:
+            revision.register(ParentModel)
+            revision.register(ChildModel, follow=('parentmodel_ptr',))
+
+    def tearDown(self):
+        if self.registered:
+            revision.unregister(ChildModel)
+            revision.unregister(ParentModel)
+
+    def test_prefetch_field_dicts_includes_parent_fields(self):
+        child = ChildModel.objects.create(parent_name='parent', child_name='child')
+        number_of_versions = random.randint(2, 20)
+        for i in range(number_of_versions):
+            revision.start()
+            try:
+                child.parent_name = 'parent-%d' % i
+                child.child_name = 'child-%d' % i
+                child.save()
+            finally:
+                revision.end()
+        versions = list(Version.objects.get_for_object(child))
+        self.assertEqual(len(versions), number_of_versions)
+        settings.DEBUG = True
+        try:
+            reset_queries()
+            Version.objects.prefetch_field_dicts(versions)
+            # A single query fetches the parent versions of every version.
+            self.assertEqual(len(connection.queries), 1)
+        finally:
+            settings.DEBUG = False
+        for i, version in enumerate(versions):
+            self.assertEqual(version.field_dict['parent_name'], 'parent-%d' % i)
+            self.assertEqual(version.field_dict['child_name'], 'child-%d' % i)
+        version = Version.objects.get(pk=versions[-1].pk)
+        self.assertEqual(version.field_dict, versions[-1].field_dict)
@@ -1,6 +1,9 @@
 from reversion import revisions
+from django.conf import settings
+from django.db import connection, reset_queries
 from django.test import TestCase
 from django.contrib.auth.models import User, Group
+from test_project.test_app.models import ChildModel, ManyToManyModel, ParentModel, RelatedModel, SelfRelatedModel, SubRelatedModel
 import random
 import datetime
 
@@ -24,6 +27,7 @@ class TestOfRevisionState(TestCase):
         self.assertEqual(state.depth, 0)
         self.assertEqual(state.is_invalid, False)
         self.assertEqual(state.meta, [])
+        self.assertEqual(state.deletions, {})
 
     def test_of_clear(self):
         state = revisions.RevisionState()
@@ -190,6 +194,38 @@ class TestOfRevisionManager(TestCase):
             self.assertTrue(group in results)
         self.assertTrue(user in results)
 
+    def test_follow_relationships_follows_symmetrical_m2m_relationships(self):
+        manager = revisions.RevisionManager()
+        manager.register(SelfRelatedModel, follow=('friends',))
+        first = SelfRelatedModel.objects.create(self_related_name='first')
+        second = SelfRelatedModel.objects.create(self_related_name='second')
+        third = SelfRelatedModel.objects.create(self_related_name='third')
+        SelfRelatedModel.objects.create(self_related_name='unrelated')
+        first.friends.add(second)
+        third.friends.add(first)
+        self.assertEqual(manager.follow_relationships(set([second])), set([first, second, third]))
+
+    def test_follow_relationships_follows_hidden_m2m_relationships(self):
+        manager = revisions.RevisionManager()
+        manager.register(SelfRelatedModel, follow=('hidden_parents',))
+        manager.register(ParentModel)
+        obj = SelfRelatedModel.objects.create(self_related_name='obj')
+        parent = ParentModel.objects.create(parent_name='parent')
+        ParentModel.objects.create(parent_name='unrelated')
+        obj.hidden_parents.add(parent)
+        self.assertEqual(manager.follow_relationships(set([obj])), set([obj, parent]))
+
+    def test_follow_plan_is_compiled_once_until_unregistered(self):
+        manager = revisions.RevisionManager()
+        manager.register(User, follow=('groups',))
+        follow_plan = manager.get_follow_plan(User)
+        self.assertTrue(manager.get_follow_plan(User) is follow_plan)
+        self.assertEqual([(step.relationship, step.kind, step.model) for step in follow_plan],
+                         [('groups', 'm2m', Group)])
+        manager.unregister(User)
+        manager.register(User, follow=('groups',))
+        self.assertFalse(manager.get_follow_plan(User) is follow_plan)
+
     def test_follow_relationships_follows_proxy_relationships(self):
         manager = revisions.RevisionManager()
         manager.register(User, follow=('groups',))
@@ -255,3 +291,228 @@ class TestOfRevisionManager(TestCase):
             self.assertTrue(group in results)
         self.assertTrue(user in results)
         self.assertTrue(user2 in results)
+
+    def test_end_saves_a_version_for_every_object_in_the_revision(self):
+        manager = revisions.RevisionManager()
+        manager.register(Group)
+        random_number_of_groups = random.randint(200, 300)
+        manager.start()
+        groups = [Group.objects.create(name='rand%d'%i) for i in range(random_number_of_groups)]
+        manager.end()
+        self.assertEqual(revisions.Version.objects.count(), random_number_of_groups)
+        self.assertEqual(revisions.Revision.objects.count(), 1)
+        for group in groups:
+            version = revisions.Version.objects.get_for_object(group).get()
+            self.assertEqual(version.object_version.object.name, group.name)
+            self.assertEqual(version.object_repr, unicode(group))
+
+    def test_end_unsets_deletions_of_saved_objects(self):
+        manager = revisions.RevisionManager()
+        manager.register(Group)
+        manager.start()
+        group = Group.objects.create(name='rand%d'%random.randint(1, 100))
+        other_group = Group.objects.create(name='rand%d-2'%random.randint(1, 100))
+        manager.end()
+        revisions.Version.objects.update(is_deleted=True)
+        manager.start()
+        group.save()
+        manager.end()
+        self.assertFalse(revisions.Version.objects.get_for_object(group).filter(is_deleted=True).exists())
+        self.assertTrue(revisions.Version.objects.get_for_object(other_group).get().is_deleted)
+
+    def test_follow_relationships_follows_reverse_foreign_keys_by_accessor_name(self):
+        manager = revisions.RevisionManager()
+        manager.register(ChildModel, follow=('relatedmodel_set',))
+        manager.register(RelatedModel, follow=('child_model',))
+        children = [ChildModel.objects.create(parent_name='parent%d'%i, child_name='child%d'%i) for i in range(3)]
+        related = [RelatedModel.objects.create(child_model=child, related_name='related%d'%i)
+                   for i, child in enumerate(children[:2] * random.randint(1, 10))]
+        results = manager.follow_relationships(set(children[:1]))
+        self.assertEqual(results, set([children[0]] + [obj for obj in related if obj.child_model == children[0]]))
+        results = manager.follow_relationships(set(related))
+        self.assertEqual(results, set(children[:2] + related))
+
+    def test_end_skips_unchanged_objects_if_ignoring_duplicates(self):
+        manager = revisions.RevisionManager()
+        manager.register(Group, ignore_duplicates=True)
+        manager.start()
+        group = Group.objects.create(name='rand%d'%random.randint(1, 100))
+        other_group = Group.objects.create(name='rand%d-2'%random.randint(1, 100))
+        manager.end()
+        manager.start()
+        group.save()
+        manager.end()
+        self.assertEqual(revisions.Version.objects.count(), 2)
+        self.assertEqual(revisions.Revision.objects.count(), 1)
+        manager.start()
+        group.name = 'changed'
+        group.save()
+        other_group.save()
+        manager.end()
+        self.assertEqual(revisions.Version.objects.get_for_object(group).count(), 2)
+        self.assertEqual(revisions.Version.objects.get_for_object(other_group).count(), 1)
+        # Deleted objects are always saved again.
+        revisions.Version.objects.get_for_object(other_group).update(is_deleted=True)
+        manager.start()
+        other_group.save()
+        manager.end()
+        self.assertEqual(revisions.Version.objects.get_for_object(other_group).count(), 2)
+
+    def test_end_saves_unchanged_followed_objects_if_ignoring_duplicates(self):
+        manager = revisions.RevisionManager()
+        manager.register(ChildModel, follow=('relatedmodel_set',))
+        manager.register(RelatedModel, ignore_duplicates=True)
+        manager.start()
+        child = ChildModel.objects.create(parent_name='parent', child_name='child')
+        changed = RelatedModel.objects.create(child_model=child, related_name='changed')
+        unchanged = RelatedModel.objects.create(child_model=child, related_name='unchanged')
+        manager.end()
+        manager.start()
+        child.child_name = 'child-2'
+        child.save()
+        changed.related_name = 'changed-2'
+        changed.save()
+        unchanged.save()
+        manager.end()
+        # The unchanged object is part of the revision, as the child follows it.
+        last_revision = revisions.Revision.objects.order_by('-pk')[0]
+        self.assertEqual(revisions.Version.objects.get_for_object(unchanged).count(), 2)
+        manager.revert_versions(last_revision.version_set.all(), delete=True)
+        self.assertTrue(RelatedModel.objects.filter(pk=unchanged.pk).exists())
+        # No revision is saved for unchanged objects that are not followed.
+        manager.start()
+        unchanged.save()
+        manager.end()
+        self.assertEqual(revisions.Revision.objects.count(), 2)
+
+    def test_deletions_during_a_revision_are_marked_at_the_end(self):
+        manager = revisions.RevisionManager()
+        manager.register(Group)
+        manager.start()
+        groups = [Group.objects.create(name='rand%d'%i) for i in range(5)]
+        manager.end()
+        manager.start()
+        try:
+            Group.objects.filter(pk__in=[group.pk for group in groups[:4]]).delete()
+            self.assertFalse(revisions.Version.objects.filter(is_deleted=True).exists())
+            settings.DEBUG = True
+            reset_queries()
+        finally:
+            manager.end()
+            settings.DEBUG = False
+        # A single update marks the deletions of the model.
+        self.assertEqual(len(connection.queries), 1)
+        self.assertEqual(revisions.Version.objects.filter(is_deleted=True).count(), 4)
+        self.assertFalse(revisions.Version.objects.get_for_object(groups[4]).get().is_deleted)
+
+    def test_deferred_mode_queues_revisions_until_flushed(self):
+        manager = revisions.RevisionManager()
+        manager.deferred = True
+        manager.register(Group)
+        manager.start()
+        group = Group.objects.create(name='rand%d'%random.randint(1, 100))
+        manager.comment = 'deferred'
+        manager.end()
+        group_pk = group.pk
+        self.assertEqual(revisions.Revision.objects.count(), 0)
+        self.assertEqual(revisions.QueuedRevision.objects.count(), 1)
+        queued_revision = revisions.QueuedRevision.objects.get()
+        group.delete()
+        self.assertEqual(manager.flush(), 2)
+        self.assertEqual(revisions.QueuedRevision.objects.count(), 0)
+        revision = revisions.Revision.objects.get()
+        self.assertEqual(revision.comment, 'deferred')
+        self.assertEqual(revision.date_created, queued_revision.date_created)
+        version = revisions.Version.objects.get()
+        self.assertEqual(version.object_id, unicode(group_pk))
+        self.assertTrue(version.is_latest)
+        self.assertTrue(version.is_deleted)
+        self.assertEqual(manager.flush(), 0)
+
+    def test_revert_restores_changed_missing_and_many_to_many_objects(self):
+        manager = revisions.revision
+        manager.register(User, follow=('groups',))
+        manager.register(Group)
+        try:
+            groups = [Group.objects.create(name='rand%d'%i) for i in range(3)]
+            group_pks = [group.pk for group in groups]
+            manager.start()
+            user = User.objects.create(username='rand%d'%random.randint(1, 100))
+            user.groups = groups[:2]
+            user.save()
+            manager.end()
+            revision = revisions.Revision.objects.get()
+            user.username = 'changed'
+            user.groups = groups[1:]
+            user.save()
+            groups[0].delete()
+            revision.revert()
+            user = User.objects.get(pk=user.pk)
+            self.assertNotEqual(user.username, 'changed')
+            self.assertEqual(set(user.groups.values_list('pk', flat=True)), set(group_pks[:2]))
+        finally:
+            manager.unregister(User)
+            manager.unregister(Group)
+
+    def test_revert_with_delete_removes_objects_added_since_the_revision(self):
+        manager = revisions.revision
+        manager.register(ChildModel, follow=('relatedmodel_set',))
+        manager.register(RelatedModel)
+        try:
+            child = ChildModel.objects.create(parent_name='parent', child_name='child')
+            manager.start()
+            related = RelatedModel.objects.create(child_model=child, related_name='related')
+            child.save()
+            manager.end()
+            revision = revisions.Revision.objects.get()
+            other_related = RelatedModel.objects.create(child_model=child, related_name='other')
+            related.related_name = 'changed'
+            related.save()
+            revision.revert(delete=True)
+            self.assertEqual(list(RelatedModel.objects.filter(child_model=child).values_list('related_name', flat=True)), ['related'])
+        finally:
+            manager.unregister(ChildModel)
+            manager.unregister(RelatedModel)
+
+    def test_revert_restores_models_with_only_many_to_many_fields(self):
+        manager = revisions.RevisionManager()
+        manager.register(ManyToManyModel)
+        parents = [ParentModel.objects.create(parent_name='parent%d' % i) for i in range(2)]
+        obj = ManyToManyModel.objects.create()
+        obj.parents = parents
+        manager.start()
+        obj.save()
+        manager.end()
+        obj.parents.clear()
+        manager.revert_versions(revisions.Version.objects.all())
+        self.assertEqual(set(obj.parents.all()), set(parents))
+
+    def test_revert_restores_both_sides_of_symmetrical_relations(self):
+        manager = revisions.RevisionManager()
+        manager.register(SelfRelatedModel)
+        first = SelfRelatedModel.objects.create(self_related_name='first')
+        second = SelfRelatedModel.objects.create(self_related_name='second')
+        first.friends.add(second)
+        manager.start()
+        first.save()
+        manager.end()
+        first.friends.clear()
+        manager.revert_versions(revisions.Version.objects.all())
+        self.assertEqual(list(first.friends.all()), [second])
+        self.assertEqual(list(second.friends.all()), [first])
+
+    def test_revert_with_delete_follows_inherited_foreign_keys(self):
+        manager = revisions.RevisionManager()
+        manager.register(ChildModel)
+        manager.register(RelatedModel)
+        manager.register(SubRelatedModel, follow=('relatedmodel_ptr',))
+        child = ChildModel.objects.create(parent_name='parent', child_name='child')
+        manager.start()
+        SubRelatedModel.objects.create(child_model=child, related_name='related', sub_related_name='sub')
+        manager.end()
+        # The inherited foreign key is only followed after the revision is saved.
+        manager.unregister(SubRelatedModel)
+        manager.register(SubRelatedModel, follow=('relatedmodel_ptr', 'child_model'))
+        manager.revert_versions(revisions.Version.objects.all(), delete=True)
+        # The child is not part of the revision, so it is deleted.
+        self.assertFalse(ChildModel.objects.filter(pk=child.pk).exists())
@@ -0,0 +1,55 @@
+from django.contrib.auth.models import User, Group, Permission
+from django.core import serializers
+from django.test import TestCase
+from reversion import fastjson
+from reversion.serialization import ModelSerializer
+from test_project.test_app.models import ChildModel, RelatedModel
+import random
+
+class TestOfModelSerializer(TestCase):
+    def assertSerializesLikeStock(self, obj, fields=None):
+        serializer = ModelSerializer(obj.__class__, fields, "json")
+        self.assertEqual(serializer.serialize(obj), serializers.serialize("json", [obj], fields=fields))
+
+    def test_output_is_identical_to_stock_json_serializer(self):
+        user = User.objects.create(username='rand%d'%random.randint(1, 100), first_name=u'\xe9t\xe9')
+        user.groups = [Group.objects.create(name='rand%d'%i) for i in range(random.randint(1, 10))]
+        user.user_permissions = Permission.objects.all()[:random.randint(1, 10)]
+        self.assertSerializesLikeStock(user)
+
+    def test_output_is_identical_for_selected_fields(self):
+        user = User.objects.create(username='rand%d'%random.randint(1, 100))
+        user.groups.create(name='rand%d'%random.randint(1, 100))
+        self.assertSerializesLikeStock(user, ('username', 'groups', 'date_joined'))
+        self.assertSerializesLikeStock(user, ())
+
+    def test_output_is_identical_for_related_models(self):
+        child = ChildModel.objects.create(parent_name='parent', child_name='child', file='test/file.txt')
+        related = RelatedModel.objects.create(child_model=child, related_name='related')
+        self.assertSerializesLikeStock(child)
+        self.assertSerializesLikeStock(related)
+        # Foreign keys are serialized without fetching the related object.
+        related = RelatedModel.objects.get(pk=related.pk)
+        self.assertSerializesLikeStock(related)
+
+    def test_other_formats_are_delegated_to_stock_serializers(self):
+        user = User.objects.create(username='rand%d'%random.randint(1, 100))
+        serializer = ModelSerializer(User, None, "xml")
+        self.assertEqual(serializer.serialize(user), serializers.serialize("xml", [user]))
+
+    def test_fastjson_is_wire_compatible_with_json(self):
+        user = User.objects.create(username='rand%d'%random.randint(1, 100), first_name=u'\xe9t\xe9/')
+        user.groups.create(name='rand%d'%random.randint(1, 100))
+        data = ModelSerializer(User, None, "fastjson").serialize(user)
+        self.assertEqual(data, serializers.serialize("json", [user]))
+        self.assertEqual(data, serializers.serialize("fastjson", [user]))
+        obj = list(serializers.deserialize("fastjson", data))[0]
+        other_obj = list(serializers.deserialize("json", data))[0]
+        for field in User._meta.fields:
+            self.assertEqual(field.value_from_object(obj.object), field.value_from_object(other_obj.object))
+        self.assertEqual(obj.m2m_data, other_obj.m2m_data)
+        self.assertEqual(obj.object.first_name, user.first_name)
+
+    def test_fastjson_decodes_floats_and_big_integers_exactly(self):
+        data = '[{"fields": {"value": 0.1234567890123456, "big": 100000000000000000000}}]'
+        self.assertEqual(fastjson.loads(data), [{"fields": {"value": 0.1234567890123456, "big": 10**20}}])
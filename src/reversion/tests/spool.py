@@ -0,0 +1,67 @@
+from django.contrib.auth.models import Group
+from django.test import TestCase
+from reversion import revisions
+from reversion.spool import Spool, read_records, take_spool
+import os
+import shutil
+import tempfile
+
+class TestOfSpool(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'spool')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_appended_records_are_read_back_in_order(self):
+        spool = Spool(self.path, sync_interval=60)
+        spool.append({'a': 1})
+        spool.append({'b': [2, u'\xe9']})
+        spool.close()
+        self.assertEqual(list(read_records(self.path)), [{'a': 1}, {'b': [2, u'\xe9']}])
+
+    def test_partly_written_records_are_skipped(self):
+        spool = Spool(self.path)
+        spool.append({'a': 1})
+        spool.close()
+        file = open(self.path, 'ab')
+        file.write('20 {"b": 2')
+        file.close()
+        spool = Spool(self.path)
+        spool.append({'c': 3})
+        spool.close()
+        self.assertEqual(list(read_records(self.path)), [{'a': 1}, {'c': 3}])
+
+    def test_writers_reopen_a_taken_spool(self):
+        spool = Spool(self.path)
+        spool.append({'a': 1})
+        loading_path = take_spool(self.path)
+        spool.append({'b': 2})
+        spool.close()
+        self.assertEqual(list(read_records(loading_path)), [{'a': 1}])
+        self.assertEqual(list(read_records(self.path)), [{'b': 2}])
+        os.remove(loading_path)
+        self.assertEqual(take_spool(self.path), loading_path)
+        os.remove(loading_path)
+        self.assertEqual(take_spool(self.path), None)
+
+    def test_spooled_revisions_are_loaded(self):
+        manager = revisions.RevisionManager()
+        manager.spool = Spool(self.path)
+        manager.register(Group)
+        manager.start()
+        group = Group.objects.create(name='spooled')
+        manager.comment = 'spooled'
+        manager.end()
+        group_pk = group.pk
+        group.delete()
+        self.assertEqual(revisions.Revision.objects.count(), 0)
+        self.assertEqual(manager.load_spool(), 2)
+        revision = revisions.Revision.objects.get()
+        self.assertEqual(revision.comment, 'spooled')
+        version = revisions.Version.objects.get()
+        self.assertEqual(version.object_id, unicode(group_pk))
+        self.assertTrue(version.is_deleted)
+        self.assertFalse(os.path.exists(self.path + '.loading'))
+        self.assertEqual(manager.load_spool(), 0)
@@ -39,6 +39,16 @@ class RelatedModel(models.Model):
         return self.related_name
     
     
+class SubRelatedModel(RelatedModel):
+    
+    sub_related_name = models.CharField(max_length=255)
+    
+    
+class ManyToManyModel(models.Model):
+    
+    parents = models.ManyToManyField(ParentModel, blank=True)
+    
+    
 class GenericRelatedModel(models.Model):
     
     content_type = models.ForeignKey(ContentType)
@@ -51,6 +61,18 @@ class GenericRelatedModel(models.Model):
         return self.generic_related_name
     
     
+class SelfRelatedModel(models.Model):
+    
+    self_related_name = models.CharField(max_length=255)
+    
+    friends = models.ManyToManyField("self", blank=True)
+    
+    hidden_parents = models.ManyToManyField(ParentModel, related_name="+", blank=True)
+    
+    def __unicode__(self):
+        return self.self_related_name
+    
+    
 class ProxyModel(ChildModel):
     
     class Meta: